@@ -1,10 +1,18 @@
 import streamlit as st
-import pandas as pd
-import geopandas as gpd
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import os
 import sys
 import re
+import json
+import functools
+import itertools
+import shutil
+import tempfile
+import hashlib
+import threading
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
 import logging
 
 # --- 环境设置 ---
@@ -12,13 +20,27 @@ import logging
 current_dir = Path(__file__).resolve().parent
 sys.path.append(str(current_dir))
 
-from core.ingestion.loader_factory import LoaderFactory
-from core.llm.AI_client import AIClient  # 确保使用的是支持 DeepSeek 的 Client
-from core.profiler.semantic_analyzer import SemanticAnalyzer
-from core.generation.code_generator import CodeGenerator
-from core.execution.executor import CodeExecutor
-from core.generation.goal_explorer import GoalExplorer
-from core.generation.viz_editor import VizEditor  # [新增] 导入编辑器
+# 注意：core.* 依赖 geopandas/pyproj 等重量级库，统一延迟到首次使用时导入，
+# 避免每次刷新页面都承担其初始化开销 (见 get_core_modules / load_data_snapshot)
+
+logger = logging.getLogger(__name__)
+
+# 数据摘要的序列化 (缓存键、磁盘缓存) 优先使用 orjson：每次生成/修复请求都要把摘要编码为键再解码，
+# orjson 在 C 中完成，并能直接处理 numpy 标量等非标准类型
+try:
+    import orjson
+
+    _ORJSON_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def _json_dumps(obj, sort_keys=False) -> bytes:
+        return orjson.dumps(obj, default=str, option=_ORJSON_OPTS | (orjson.OPT_SORT_KEYS if sort_keys else 0))
+
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj, sort_keys=False) -> bytes:
+        return json.dumps(obj, sort_keys=sort_keys, ensure_ascii=False, default=str).encode("utf-8")
+
+    _json_loads = json.loads
 
 # 配置页面
 st.set_page_config(
@@ -30,6 +52,10 @@ st.set_page_config(
 
 
 # --- 辅助工具：变量名清洗 ---
+_BAD_CHARS = re.compile(r'[^a-zA-Z0-9]')
+
+
+@functools.lru_cache(maxsize=256)
 def sanitize_var_name(filename):
     """
     将文件名转换为合法的 Python 变量名。
@@ -38,11 +64,9 @@ def sanitize_var_name(filename):
     # 移除扩展名
     name = os.path.splitext(filename)[0]
     # 替换非字母数字为下划线
-    clean_name = re.sub(r'[^a-zA-Z0-9]', '_', name)
-    # 避免数字开头, 且统一加 df_ 前缀
-    if clean_name[0].isdigit():
-        clean_name = "df_" + clean_name
-    elif not clean_name.startswith("df_"):
+    clean_name = _BAD_CHARS.sub('_', name)
+    # 避免数字开头 (或空名), 且统一加 df_ 前缀
+    if not clean_name or clean_name[0].isdigit() or not clean_name.startswith("df_"):
         clean_name = "df_" + clean_name
     return clean_name.lower()
 
@@ -50,6 +74,22 @@ def sanitize_var_name(filename):
 # --- 缓存资源 ---
 @st.cache_resource
 def get_core_modules():
+    # cache_resource 保证以下导入在每个进程中只执行一次
+    from core.llm.AI_client import AIClient  # 确保使用的是支持 DeepSeek 的 Client
+    from core.profiler.semantic_analyzer import SemanticAnalyzer
+    from core.generation.code_generator import CodeGenerator
+    from core.execution.executor import CodeExecutor
+    from core.generation.goal_explorer import GoalExplorer
+    from core.generation.viz_editor import VizEditor  # [新增] 导入编辑器
+
+    # Plotly 图表序列化改用 orjson (C 实现，直接编码 numpy 数组)，大图表的 to_json 显著加速
+    try:
+        import orjson  # noqa: F401
+        import plotly.io as pio
+        pio.json.config.default_engine = "orjson"
+    except ImportError:
+        logger.info("orjson not installed, Plotly keeps the default JSON engine.")
+
     try:
         # 这里使用 DeepSeek 模型
         client = AIClient(
@@ -67,32 +107,190 @@ def get_core_modules():
         return None, None, None, None, None
 
 
-@st.cache_data
+# --- 磁盘缓存：按文件内容哈希复用分析结果 (跨会话/进程有效) ---
+SANDBOX_DIR = "data_sandbox"
+CACHE_DIR = os.path.join(SANDBOX_DIR, ".cache")
+ANALYSIS_SAMPLE_ROWS = 10000
+# 地理矢量数据 (.zip 为打包的 Shapefile，由 GDAL /vsizip/ 直接读取)
+GEO_EXTS = ('.shp', '.geojson', '.zip')
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """以 1MB 分块流式计算文件的 sha256，避免整文件读入内存"""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cached_analyze(analyzer, file_path):
+    """
+    带磁盘缓存的 analyzer.analyze。
+    重复上传内容相同的文件时直接读取缓存的摘要，跳过 LLM 往返。
+    """
+    digest = file_digest(file_path)
+    cache_path = os.path.join(CACHE_DIR, f"{digest}.json")
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                summary = _json_loads(f.read())
+            # 同样内容可能以不同文件名上传，路径信息以本次为准
+            summary["file_info"] = {"path": str(file_path), "name": Path(file_path).name}
+            return summary
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring broken analysis cache {cache_path}: {e}")
+
+    # 只读取一次样本 (1 万行足够推断 dtype / 语义标签 / 样本值)，分析器不再自行读文件
+    from core.ingestion.loader_factory import LoaderFactory
+
+    try:
+        sample = LoaderFactory.get_loader(file_path).peek(file_path, n=ANALYSIS_SAMPLE_ROWS)
+    except Exception as e:
+        return {"error": f"Failed to load file: {str(e)}"}
+    summary = analyzer.analyze_from_sample(sample, file_path)
+    if "error" not in summary:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # 临时文件名唯一，允许多个线程同时写入同一份缓存
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(_json_dumps(summary))
+        os.replace(tmp_path, cache_path)
+    return summary
+
+
+def make_thread_pool(max_workers):
+    """创建线程池，并把当前脚本的 ScriptRunContext 附加到工作线程上"""
+    ctx = get_script_run_ctx()
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=add_script_run_ctx, initargs=(None, ctx))
+
+
+def _file_identity(path):
+    """cache_data 的哈希函数：路径 + 大小 + 修改时间，内容变化时自动失效"""
+    if isinstance(path, str) and os.path.exists(path):
+        return path, os.path.getsize(path), os.path.getmtime(path)
+    return path
+
+
+def downcast_frame(df):
+    """
+    采样模式下收窄数值类型 (float64->float32, int64->int32)，
+    并把低基数的字符串列转为 category，内存与 Plotly JSON 体积约减半。
+    整数最多收窄到 int32：生成代码常对 ID/计数做逐元素运算 (如 df.PULocationID * 1000)，
+    int8/int16 会静默溢出，得到与全量模式不同的结果。
+    """
+    import numpy as np
+    import pandas as pd
+
+    int32 = np.iinfo(np.int32)
+    for col in df.select_dtypes(include=['float64']).columns:
+        df[col] = pd.to_numeric(df[col], downcast='float')
+    for col in df.select_dtypes(include=['int64']).columns:
+        if len(df) and int32.min <= df[col].min() and df[col].max() <= int32.max:
+            df[col] = df[col].astype(np.int32)
+    if len(df):
+        for col in df.select_dtypes(include=['object']).columns:
+            try:
+                n_unique = df[col].nunique()
+            except TypeError:
+                # 单元格是 list/dict 等不可哈希对象，不适合转 category
+                continue
+            if n_unique / len(df) < 0.5:
+                df[col] = df[col].astype('category')
+    return df
+
+
+@st.cache_data(hash_funcs={str: _file_identity}, max_entries=8, ttl=1800)
 def load_data_snapshot(file_path, use_full_data=False):
-    """加载单个文件的数据"""
+    """加载单个文件的数据 (全量模式保留原始精度，供统计计算使用)"""
+    from core.ingestion.loader_factory import LoaderFactory
+
     loader = LoaderFactory.get_loader(file_path)
 
-    # 地理数据通常全量加载
-    if file_path.endswith('.shp') or file_path.endswith('.geojson'):
-        return loader.load(file_path)
+    # 地理数据走 pyogrio 读取；极速模式下同样只取前 50000 个要素
+    if file_path.lower().endswith(GEO_EXTS):
+        if use_full_data:
+            return loader.load(file_path)
+        return downcast_frame(loader.load(file_path, max_features=50000))
 
     if use_full_data:
         return loader.load(file_path)
     else:
-        return loader.peek(file_path, n=50000)
+        return downcast_frame(loader.peek(file_path, n=50000))
+
+
+class LazyDataContext(dict):
+    """
+    惰性的 data_context：变量在第一次被访问时才通过 load_data_snapshot 加载，
+    只涉及单个数据集的查询不会触发其它文件的读取。
+    可直接作为 exec 的 locals 使用 (非 dict 精确类型时名字查找会经过 __getitem__)。
+    """
+
+    def __init__(self, summaries, use_full_data):
+        super().__init__()
+        self._paths = {s['variable_name']: s['file_info']['path'] for s in summaries}
+        self._use_full_data = use_full_data
+
+    def __getitem__(self, key):
+        if not dict.__contains__(self, key):
+            # 未知变量名照常抛出 KeyError
+            path = self._paths[key]
+            self[key] = load_data_snapshot(path, use_full_data=self._use_full_data)
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._paths
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._paths.keys() | dict.keys(self)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    @property
+    def cache_token(self):
+        """
+        上下文的稳定标识 (文件路径 + 修改时间 + 加载模式)，供 CodeExecutor 缓存图表。
+        每次脚本重跑都会新建 LazyDataContext，因此不能使用 id()。
+        """
+        return (self._use_full_data,) + tuple(sorted(
+            (var, path, os.path.getmtime(path) if os.path.exists(path) else None)
+            for var, path in self._paths.items()
+        ))
+
+    def copy(self):
+        """副本共享同一组文件 (已加载的对象直接复用)，写入不会影响原上下文"""
+        clone = LazyDataContext([], self._use_full_data)
+        clone._paths = dict(self._paths)
+        clone.update(dict.items(self))
+        return clone
 
 
 def save_uploaded_files(uploaded_files):
     """保存所有上传的文件到 data_sandbox"""
-    save_dir = "data_sandbox"
+    save_dir = SANDBOX_DIR
     if not os.path.exists(save_dir):
         os.makedirs(save_dir)
 
     saved_paths = []
     for up_file in uploaded_files:
         file_path = os.path.join(save_dir, up_file.name)
-        with open(file_path, "wb") as f:
-            f.write(up_file.getbuffer())
+        # Streamlit 每次交互都会重跑脚本：已落盘且大小一致的文件不再重复写入
+        if not (os.path.exists(file_path) and os.path.getsize(file_path) == up_file.size):
+            # 按 1MB 分块流式写入，避免 getbuffer() 整体物化带来的内存峰值
+            up_file.seek(0)
+            with open(file_path, "wb") as f:
+                shutil.copyfileobj(up_file, f, length=1 << 20)
         saved_paths.append(file_path)
     return saved_paths
 
@@ -101,77 +299,212 @@ def get_analyzable_files(file_paths):
     """
     筛选出主数据文件（排除 .dbf, .shx 等伴生文件）。
     """
-    valid_exts = ['.csv', '.parquet', '.shp', '.geojson', '.xlsx']
+    valid_exts = ['.csv', '.parquet', '.shp', '.geojson', '.xlsx', '.zip']
     return [f for f in file_paths if os.path.splitext(f)[1].lower() in valid_exts]
 
 
+# --- LLM 调用缓存 ---
+# 相同 (指令, 数据摘要) 的请求直接复用结果，“重新生成”与重复的自愈修复无需再次请求 LLM。
+# 模块对象无法被 Streamlit 哈希，以下划线前缀参数传入以跳过哈希；摘要以稳定的 JSON 串作为键。
+def summaries_cache_key(summaries):
+    return _json_dumps(summaries, sort_keys=True).decode("utf-8")
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def cached_generate_code(query, summaries_key, _generator):
+    return _generator.generate_code(query, _json_loads(summaries_key))
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def cached_fix_code(code, error, summaries_key, _generator):
+    return _generator.fix_code(code, error, _json_loads(summaries_key))
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def cached_edit_code(original_code, query, summaries_key, _editor):
+    return _editor.edit_code(original_code=original_code, query=query, summaries=_json_loads(summaries_key))
+
+
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def cached_generate_goals(summary_key, _explorer):
+    return _explorer.generate_goals(_json_loads(summary_key))
+
+
+# --- 输入控制区控件 (固定 key，跨重跑保持状态) ---
+def render_regen_button(slot):
+    return slot.button("🔄 重新生成", key="regen_button", help="重试上一次指令")
+
+
+def render_new_chart_toggle(slot):
+    return slot.toggle(
+        "🆕 新图表模式",
+        value=False,
+        key="force_new_toggle",
+        help="开启后将忽略当前图表，根据指令重新生成新图。"
+    )
+
+
+# --- 对话历史 ---
+# 消息以 (role, type, content) 元组存放在定长 deque 中：比三键字典省内存，且历史长度有上限
+MAX_HISTORY = 200
+
+
+def push_message(role, msg_type, content):
+    st.session_state.messages.append((role, msg_type, content))
+
+
+def render_message(msg):
+    """渲染单条历史消息"""
+    role, msg_type, content = msg
+    with st.chat_message(role):
+        if msg_type == "text":
+            st.markdown(content)
+        elif msg_type == "plot":
+            st.plotly_chart(content, use_container_width=True)
+        elif msg_type == "code":
+            with st.expander("查看代码"):
+                st.code(content, language="python")
+
+
 # --- 核心查询处理 (统一入口) ---
-def handle_query(query_text, summaries, modules, data_context, force_new=False):
+# 生成 -> 执行 -> 自愈 的整条流水线在后台线程中运行，脚本线程只负责轮询进度与渲染，
+# 因此长时间的自愈循环中页面仍可响应，用户也可以随时取消。
+@st.cache_resource
+def get_worker_pools():
+    """
+    (流水线线程池, 自愈修复线程池)。本文件是 Streamlit 主脚本，模块顶层在每次 rerun 时都会重新执行，
+    线程池必须经 cache_resource 创建，才能在所有 rerun 与会话之间共享同一组线程 (4 线程上限才真正生效)。
+    自愈修复的 LLM 请求单独使用一个池，避免流水线线程在同一个池里等待自己提交的任务而死锁。
+    """
+    return (ThreadPoolExecutor(max_workers=4, thread_name_prefix="query-pipeline"),
+            ThreadPoolExecutor(max_workers=4, thread_name_prefix="query-fix"))
+
+
+def run_with_ctx(ctx, fn, *args):
+    add_script_run_ctx(threading.current_thread(), ctx)
+    return fn(*args)
+
+
+class QueryCancelled(Exception):
+    """用户主动取消了正在执行的查询"""
+
+
+def run_query_pipeline(job, query_text, summaries_key, modules, data_context, base_code, ctx):
+    """
+    后台线程执行的流水线 (不直接调用任何 st.* 渲染接口)。
+    进度文本追加到 job["progress"]，取消信号通过 job["cancel"] 传递。
+    """
+    add_script_run_ctx(threading.current_thread(), ctx)
+    generator, executor, editor = modules
+    progress, cancel = job["progress"], job["cancel"]
+
+    def checkpoint(message):
+        if cancel.is_set():
+            raise QueryCancelled()
+        progress.append(message)
+
+    # === 逻辑分流: 编辑 vs 生成 ===
+    if base_code:
+        checkpoint("🎨 正在基于现有图表进行修改 (Editing)...")
+        code = cached_edit_code(base_code, query_text, summaries_key, editor)
+    else:
+        checkpoint("🤔 正在构思新图表 (Generating)...")
+        code = cached_generate_code(query_text, summaries_key, generator)
+
+    # === 执行代码 ===
+    checkpoint("⚡ 正在执行代码...")
+    res = executor.execute(code, data_context)
+
+    # === 自愈机制 (Self-Healing) ===
+    # 这里复用 generator 的 fix_code，因为它包含最全的 GIS 规则库
+    retries = 3
+    count = 0
+    while not res.success and count < retries:
+        count += 1
+        checkpoint(f"⚠️ 代码报错，正在进行第 {count} 次自动修复...")
+        fix_future = get_worker_pools()[1].submit(run_with_ctx, ctx, cached_fix_code, code, res.error, summaries_key, generator)
+        # LLM 往返期间在当前线程预热执行环境 (Numba 内核等)，修复代码返回后可直接执行
+        executor.warmup(code)
+        fixed_code = fix_future.result()
+        if fixed_code == code:
+            # LLM 原样返回了代码，再执行只会得到同样的错误，提前结束自愈
+            break
+        code = fixed_code
+        res = executor.execute(code, data_context)
+
+    return code, res
+
+
+def cancel_query_job():
+    job = st.session_state.exec_job
+    if job:
+        job["cancel"].set()
+        job["future"].cancel()
+
+
+def handle_query(query_text, summaries, modules, data_context, chat_box, force_new=False):
     """
     处理查询逻辑：区分 生成新图(Generate) 和 修改旧图(Edit)
     modules: (generator, executor, editor)
+    只负责提交后台任务，进度与结果由 watch_query_job 片段轮询。
     """
-    # 解包模块
-    generator, executor, editor = modules
+    # 如果存在上下文代码，且用户没有强制开启“新图表模式”，则进入编辑模式
+    base_code = st.session_state.last_generated_code if not force_new else None
 
-    # 1. 记录用户消息
-    st.session_state.messages.append({"role": "user", "type": "text", "content": query_text})
-    with st.chat_message("user"):
-        st.markdown(query_text)
+    # 1. 记录用户消息 (本轮的历史记录已绘制完，新消息直接追加到聊天容器)
+    push_message("user", "text", query_text)
+    with chat_box:
+        render_message(st.session_state.messages[-1])
 
-    # 2. AI 处理
-    with st.chat_message("assistant"):
-        msg_holder = st.empty()
+    # 2. 提交后台任务
+    job = {"progress": ["⏳ 正在排队..."], "cancel": threading.Event()}
+    job["future"] = get_worker_pools()[0].submit(
+        run_query_pipeline, job, query_text, summaries_cache_key(summaries), modules, data_context,
+        base_code, get_script_run_ctx()
+    )
+    st.session_state.exec_job = job
 
-        try:
-            # === 逻辑分流: 编辑 vs 生成 ===
-            # 如果存在上下文代码，且用户没有强制开启“新图表模式”，则进入编辑模式
-            if st.session_state.last_generated_code and not force_new:
-                msg_holder.markdown("🎨 正在基于现有图表进行修改 (Editing)...")
-                code = editor.edit_code(
-                    original_code=st.session_state.last_generated_code,
-                    query=query_text,
-                    summaries=summaries
-                )
-            else:
-                msg_holder.markdown("🤔 正在构思新图表 (Generating)...")
-                code = generator.generate_code(query_text, summaries)
-
-            # === 执行代码 ===
-            msg_holder.markdown("⚡ 正在执行代码...")
-            res = executor.execute(code, data_context)
-
-            # === 自愈机制 (Self-Healing) ===
-            # 这里复用 generator 的 fix_code，因为它包含最全的 GIS 规则库
-            retries = 3
-            count = 0
-            while not res.success and count < retries:
-                count += 1
-                msg_holder.warning(f"⚠️ 代码报错，正在进行第 {count} 次自动修复...")
-                code = generator.fix_code(code, res.error, summaries)
-                res = executor.execute(code, data_context)
-
-            # === 结果展示 ===
-            if res.success:
-                # [关键] 更新上下文代码
-                st.session_state.last_generated_code = code
-
-                # 保存到历史记录
-                st.session_state.messages.append({"role": "assistant", "type": "plot", "content": res.result})
-                st.session_state.messages.append({"role": "assistant", "type": "code", "content": code})
-
-                # [核心修复] 强制页面重绘，确保按钮区能立刻检测到 last_generated_code 并显示出来
-                st.rerun()
-
-            else:
-                err_msg = f"❌ 执行失败: \n```\n{res.error}\n```"
-                msg_holder.error(err_msg)
-                st.session_state.messages.append({"role": "assistant", "type": "text", "content": err_msg})
-                with st.expander("查看最后代码"):
-                    st.code(code, language="python")
-
-        except Exception as e:
-            st.error(f"System Error: {e}")
+
+# 进度面板的刷新间隔 (秒)
+POLL_INTERVAL = 0.5
+
+
+@st.fragment(run_every=POLL_INTERVAL)
+def watch_query_job():
+    """
+    展示后台任务的进度。片段按 POLL_INTERVAL 单独重跑 (不重跑整页、不回放历史)，
+    脚本线程不会阻塞在等待上，取消按钮等控件随时可以响应。
+    任务结束后把结果写入历史记录，再整页重跑一次：本轮起不再调用本片段，轮询随之停止。
+    """
+    job = st.session_state.exec_job
+    if job is None:
+        return
+
+    if not job["future"].done():
+        with st.chat_message("assistant"):
+            st.status(job["progress"][-1], expanded=False)
+            st.button("⏹ 取消", key="cancel_query", on_click=cancel_query_job)
+        return
+
+    st.session_state.exec_job = None
+    try:
+        code, res = job["future"].result()
+    except (QueryCancelled, CancelledError):
+        push_message("assistant", "text", "⏹ 已取消本次查询。")
+    except Exception as e:
+        push_message("assistant", "text", f"❌ System Error: {e}")
+    else:
+        if res.success:
+            # [关键] 更新上下文代码
+            st.session_state.last_generated_code = code
+            push_message("assistant", "plot", res.result)
+            push_message("assistant", "code", code)
+        else:
+            push_message("assistant", "text", f"❌ 执行失败: \n```\n{res.error}\n```")
+            push_message("assistant", "code", code)
+
+    # 结果绘制在历史记录中；重新生成按钮、新图表开关也按新的上下文显示
+    st.rerun()
 
 
 # --- 主程序 ---
@@ -186,16 +519,18 @@ def main():
     modules_pack = (generator, executor, editor)
 
     # Session State 初始化
-    if "messages" not in st.session_state: st.session_state.messages = []
+    if "messages" not in st.session_state: st.session_state.messages = deque(maxlen=MAX_HISTORY)
     if "data_summaries" not in st.session_state: st.session_state.data_summaries = []
     if "uploaded_filenames" not in st.session_state: st.session_state.uploaded_filenames = []
     if "suggested_goals" not in st.session_state: st.session_state.suggested_goals = []
     if "prompt_trigger" not in st.session_state: st.session_state.prompt_trigger = None
     if "last_use_full" not in st.session_state: st.session_state.last_use_full = False
+    if "analysis_done" not in st.session_state: st.session_state.analysis_done = False
 
     # 上下文状态
     if "last_generated_code" not in st.session_state: st.session_state.last_generated_code = None
     if "last_query" not in st.session_state: st.session_state.last_query = None
+    if "exec_job" not in st.session_state: st.session_state.exec_job = None
 
     # 侧边栏
     with st.sidebar:
@@ -220,62 +555,79 @@ def main():
             st.session_state.uploaded_filenames = current_names
             st.session_state.last_use_full = use_full
             st.session_state.data_summaries = []
-            st.session_state.messages = []
+            st.session_state.analysis_done = False
+            st.session_state.messages = deque(maxlen=MAX_HISTORY)
             st.session_state.suggested_goals = []
             st.session_state.last_generated_code = None
             st.session_state.last_query = None
-            st.cache_data.clear()
+            if st.session_state.exec_job:
+                cancel_query_job()
+                st.session_state.exec_job = None
+            # 不清空 st.cache_data：缓存键已包含文件身份与 use_full_data，
+            # 切换模式时两种快照各自命中缓存，无关文件的缓存也不受影响
 
     if uploaded_files:
         # 1. 保存与筛选
-        all_paths = save_uploaded_files(uploaded_files)
+        # 文件列表未变且均已落盘时直接复用路径，避免每次交互重跑都重新写盘
+        sandbox_paths = [os.path.join(SANDBOX_DIR, name) for name in current_names]
+        if not file_changed and all(os.path.exists(p) for p in sandbox_paths):
+            all_paths = sandbox_paths
+        else:
+            all_paths = save_uploaded_files(uploaded_files)
         analyzable_paths = get_analyzable_files(all_paths)
 
         if not analyzable_paths:
             st.warning("已上传文件，但未检测到支持的主数据格式 (.csv, .parquet, .shp)。")
         else:
-            # 2. 分析语义
-            if not st.session_state.data_summaries:
-                summaries = []
+            # 2. 分析语义 (每组文件只分析一次；即使全部失败也不在后续重跑中反复重试)
+            if not st.session_state.analysis_done:
+                results = {}
                 with st.status("🔍 正在解析多源数据...", expanded=True) as status:
-                    for path in analyzable_paths:
-                        fname = os.path.basename(path)
-                        st.write(f"正在分析: {fname} ...")
-
-                        summary = analyzer.analyze(path)
-                        if "error" not in summary:
-                            var_name = sanitize_var_name(fname)
-                            summary['variable_name'] = var_name
-                            summaries.append(summary)
-                            st.write(f"✅ 已加载为变量: `{var_name}`")
-                        else:
-                            st.error(f"{fname} 分析失败: {summary['error']}")
-
+                    # 每个文件的分析都包含一次 LLM 请求 (I/O 密集)，用线程并发发起
+                    st.write(f"正在分析: {', '.join(os.path.basename(p) for p in analyzable_paths)} ...")
+                    with make_thread_pool(min(8, len(analyzable_paths))) as pool:
+                        futures = {pool.submit(cached_analyze, analyzer, p): p for p in analyzable_paths}
+                        # 进度信息在主线程中按完成顺序输出
+                        for fut in as_completed(futures):
+                            path = futures[fut]
+                            fname = os.path.basename(path)
+                            try:
+                                summary = fut.result()
+                            except Exception as e:
+                                summary = {"error": str(e)}
+
+                            if "error" not in summary:
+                                var_name = sanitize_var_name(fname)
+                                summary['variable_name'] = var_name
+                                # 预先截取展示用的前 5 个列名，避免每次重跑都物化完整列名列表
+                                summary['preview_cols'] = tuple(
+                                    itertools.islice(summary['basic_stats']['column_stats'], 5))
+                                results[path] = summary
+                                st.write(f"✅ 已加载为变量: `{var_name}`")
+                            else:
+                                st.error(f"{fname} 分析失败: {summary['error']}")
+
+                    # 保持与上传顺序一致 (推荐问题基于第一个文件生成)
+                    summaries = [results[p] for p in analyzable_paths if p in results]
                     st.session_state.data_summaries = summaries
+                    st.session_state.analysis_done = True
 
                     if summaries:
                         st.write("💡 生成分析建议...")
-                        st.session_state.suggested_goals = explorer.generate_goals(summaries[0])
+                        st.session_state.suggested_goals = cached_generate_goals(
+                            summaries_cache_key(summaries[0]), explorer)
 
                     status.update(label="✅ 所有文件加载完成", state="complete", expanded=False)
 
-            # 3. 准备数据上下文
-            data_context = {}
-            for summary in st.session_state.data_summaries:
-                path = summary['file_info']['path']
-                var_name = summary['variable_name']
-                try:
-                    df = load_data_snapshot(path, use_full_data=use_full)
-                    data_context[var_name] = df
-                except Exception as e:
-                    st.error(f"加载变量 {var_name} 失败: {e}")
+            # 3. 准备数据上下文 (惰性：生成的代码第一次访问某个变量时才加载对应文件)
+            data_context = LazyDataContext(st.session_state.data_summaries, use_full)
 
             # 4. UI 展示
             if st.session_state.data_summaries:
                 with st.expander("📊 已加载的数据集变量 (可在对话中直接使用)", expanded=True):
                     for summary in st.session_state.data_summaries:
                         st.markdown(f"**`{summary['variable_name']}`** ({summary['file_info']['name']})")
-                        st.caption(f"包含列: {', '.join(list(summary['basic_stats']['column_stats'].keys())[:5])}...")
+                        st.caption(f"包含列: {', '.join(summary['preview_cols'])}...")
 
             # 5. 交互区域
             st.divider()
@@ -289,15 +641,12 @@ def main():
                         st.session_state.prompt_trigger = goal
 
             # B. 历史记录 (这里会显示成功后的图表)
-            for msg in st.session_state.messages:
-                with st.chat_message(msg["role"]):
-                    if msg["type"] == "text":
-                        st.markdown(msg["content"])
-                    elif msg["type"] == "plot":
-                        st.plotly_chart(msg["content"], use_container_width=True)
-                    elif msg["type"] == "code":
-                        with st.expander("查看代码"):
-                            st.code(msg["content"], language="python")
+            # 整页重跑时前端元素树会整体重建，因此每轮都要完整绘制历史；
+            # 本轮新提交的用户提问由 handle_query 直接追加到容器末尾；查询结果在任务结束后的整页重跑中随历史绘制
+            chat_box = st.container()
+            with chat_box:
+                for msg in st.session_state.messages:
+                    render_message(msg)
 
             # --- 输入与控制区 ---
             col_tools = st.columns([1, 1.5, 5])
@@ -306,17 +655,12 @@ def main():
 
             # C. 重新生成按钮
             if st.session_state.last_query:
-                if col_tools[0].button("🔄 重新生成", help="重试上一次指令"):
+                if render_regen_button(col_tools[0]):
                     trigger_query = st.session_state.last_query
 
             # D. 新图表模式开关 (仅当有上下文时显示)
             if st.session_state.last_generated_code:
-                with col_tools[1]:
-                    force_new_toggle = st.toggle(
-                        "🆕 新图表模式",
-                        value=False,
-                        help="开启后将忽略当前图表，根据指令重新生成新图。"
-                    )
+                force_new_toggle = render_new_chart_toggle(col_tools[1])
 
             # E. 输入框
             chat_input_val = st.chat_input("输入指令 (例如 '把颜色改成红色' 或 '关联表A和表B')")
@@ -330,11 +674,17 @@ def main():
                 trigger_query = chat_input_val
 
             # 执行处理
-            if trigger_query:
+            if trigger_query and st.session_state.exec_job:
+                st.toast("上一条指令仍在处理中，请稍候或先取消。")
+            elif trigger_query:
                 st.session_state.last_query = trigger_query
                 # 传递所有模块包
                 handle_query(trigger_query, st.session_state.data_summaries, modules_pack, data_context,
-                             force_new=force_new_toggle)
+                             chat_box, force_new=force_new_toggle)
+
+            if st.session_state.exec_job:
+                with chat_box:
+                    watch_query_job()
 
     else:
         st.markdown("""
@@ -344,7 +694,7 @@ def main():
 
         **💡 提示：**
         - **多文件**: 支持同时上传多个文件（如业务数据 + 区域 Shapefile）。
-        - **Shapefile**: 请务必上传 `.shp` 及其依赖文件 (`.dbf`, `.shx`)。
+        - **Shapefile**: 请上传 `.shp` 及其依赖文件 (`.dbf`, `.shx`)，或直接上传打包好的 `.zip`。
         - **交互**: 支持基于当前图表进行多轮对话修改（如 "把图例去掉"）。
         """)
 
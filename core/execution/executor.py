@@ -1,20 +1,112 @@
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import plotly.express as px
 import plotly.graph_objects as go
+import ast
+import builtins
 import traceback
-import sys
 import io
-import re
+import sys
+import threading
 import textwrap
-from typing import Dict, Any, Optional
+import types
+from collections import ChainMap, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Any, NamedTuple, Optional, Tuple
 import logging
 
+from core.execution import fast_ops
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+_FENCE = "```"
+
+def _extract_last_fence(text: str, tag: str) -> Optional[str]:
+    """
+    用 str.find / rfind 定位最后一个以 tag 开头的 Markdown 代码块，返回块内原文 (不含首行)。
+    tag 为 ``` 时匹配任意代码块；未找到完整代码块时返回 None。
+    """
+    if tag == _FENCE:
+        close = text.rfind(_FENCE)
+        start = text.rfind(_FENCE, 0, close) if close > 0 else -1
+    else:
+        # ```python 大小写不敏感；结束符取 opener 之后的第一个 ```
+        start = text.lower().rfind(tag)
+        close = -1
+        if start != -1:
+            newline = text.find("\n", start)
+            close = text.find(_FENCE, newline) if newline != -1 else -1
+    if start == -1 or close == -1:
+        return None
+
+    # 丢弃 ```python 所在的首行（不吞噬下一行的缩进）
+    parts = text[start:close].split("\n", 1)
+    return parts[1] if len(parts) == 2 else None
+
+
+def _dedent(block: str) -> str:
+    """
+    textwrap.dedent 的快速路径：LLM 代码块通常整体带同一层 Markdown 缩进，
+    取首个非空行的缩进做一次 str.replace 即可；缩进混用 tab/空格或有行缩进更浅时回退 dedent。
+    """
+    lines = block.splitlines()
+    first = next((line for line in lines if line.strip()), None)
+    if first is None:
+        return ""
+    indent = first[:len(first) - len(first.lstrip())]
+    if not indent:
+        return block
+    if (" " in indent and "\t" in indent) or any(
+            line.strip() and not line.startswith(indent) for line in lines):
+        return textwrap.dedent(block)
+    return block.lstrip("\n").removeprefix(indent).replace("\n" + indent, "\n")
+
+
+class _CompiledCode(NamedTuple):
+    code: types.CodeType
+    has_plot: bool  # 顶层是否定义了 plot 函数 (Scaffold 模式)
+    has_print: bool  # 是否引用了全局名字 print (无引用时直接共用 global_context)
+
+
+# 已编译代码对象缓存：自愈循环中 LLM 经常原样返回同一段代码，避免重复解析与编译
+@lru_cache(maxsize=128)
+def _compile(src: str) -> _CompiledCode:
+    # 语法校验只走解析器：SyntaxError 在 ast.parse 阶段抛出，不会进入编译或执行；
+    # 编译直接复用同一棵 AST，无需再次解析源码
+    tree = ast.parse(src, "<llm>", mode="exec")
+    has_plot = any(isinstance(node, ast.FunctionDef) and node.name == "plot" for node in tree.body)
+    # 任何对名字 print 的引用都算 (print(...)、p = print、map(print, ...))：它们都经全局名查找拿到 print，
+    # 可以被 exec_globals 中的缓冲版本替换。builtins.print、from builtins import print 以及直接写 sys.stdout
+    # 绕过全局名，只有替换进程级 sys.stdout 才能截获 (见 _run 中的说明)，这类输出照常写到服务端 stdout
+    has_print = any(isinstance(node, ast.Name) and node.id == "print" for node in ast.walk(tree))
+    return _CompiledCode(compile(tree, "<llm>", "exec"), has_plot, has_print)
+
+
+def _format_user_trace(limit: int = 10) -> str:
+    """
+    格式化当前异常，只保留与生成代码相关的最后 limit 个栈帧 (丢弃 site-packages 中的框架内部栈帧)，
+    减少发送给 LLM 自愈时的噪音与 Token。须在 except 块中调用。
+    """
+    exc = traceback.TracebackException(*sys.exc_info())
+    frames = [f for f in exc.stack if f.filename == "<llm>" or "site-packages" not in f.filename][-limit:]
+    return ("Traceback (most recent call last):\n"
+            + "".join(traceback.format_list(frames))
+            + "".join(exc.format_exception_only()))
+
+
+def _buffered_print(buf: io.StringIO):
+    """返回写入 buf 的 print：只作用于本次执行，不触碰进程级的 sys.stdout (并发执行时互不干扰)"""
+    def _print(*args, **kwargs):
+        kwargs.setdefault("file", buf)
+        print(*args, **kwargs)
+    return _print
+
+
 class ExecutionResult:
     def __init__(self, success: bool, result: Any = None, error: str = None, code: str = ""):
         self.success = success
@@ -24,45 +116,63 @@ class ExecutionResult:
 
 
 class CodeExecutor:
-    def __init__(self):
+    # 成功执行的图表缓存条目数 (LRU 淘汰)
+    _FIG_CACHE_SIZE = 32
+
+    def __init__(self, max_workers: int = 4):
+        self._fig_cache: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._fig_lock = threading.Lock()
+        # execute_async 使用的线程池：pandas/numpy 的 C 扩展会释放 GIL，调用方可在等待期间处理其他请求
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="code-exec")
         self.global_context = {
             "pd": pd,
+            "np": np,
             "gpd": gpd,
             "px": px,
             "go": go,
-            "print": print
+            "fast_ops": fast_ops,  # Numba 加速的数值工具 (距离、网格计数等)
+            "fast_groupby_count": fast_ops.groupby_count_i64,
+            "aggregate_and_join": fast_ops.aggregate_and_join,
+            "print": print,
+            # 显式提供 __builtins__，exec 不必在每次调用时再向 globals 注入
+            # 注意保留完整内置函数：生成代码需要 __import__ (import 语句) 以及 getattr/Exception 等
+            "__builtins__": builtins.__dict__,
         }
 
+    def warmup(self, code_str: Optional[str] = None) -> None:
+        """
+        预热执行环境：编译 Numba 内核，并预先编译 (缓存) 给定的代码。
+        用于与自愈修复的 LLM 请求并行执行，把这部分耗时藏在网络往返之后。
+        """
+        fast_ops.warmup()
+        if code_str:
+            try:
+                _compile(self._clean_code(code_str))
+            except SyntaxError:
+                pass
+
     def _clean_code(self, text: str) -> str:
         """
         从 LLM 回复中精准提取 Python 代码块，并自动去除缩进。
         """
-        # 匹配 ```python 后的内容，但非贪婪地处理首行换行
-        # (?:[^\n]*\n) 匹配 ```python 后面的任意字符直到换行符（不吞噬下一行的缩进）
-        pattern_python = r'```python(?:[^\n]*\n)(.*?)```'
-
-        # 通用匹配
-        pattern_generic = r'```(?:[^\n]*\n)(.*?)```'
-
-        code_block = None
-
-        # 优先寻找 ```python
-        # re.DOTALL 让 . 匹配换行符
-        matches = re.findall(pattern_python, text, re.DOTALL | re.IGNORECASE)
-        if matches:
-            code_block = matches[-1]
-
-        # 其次寻找 ```
-        elif re.findall(pattern_generic, text, re.DOTALL | re.IGNORECASE):
-            code_block = re.findall(pattern_generic, text, re.DOTALL | re.IGNORECASE)[-1]
+        # 优先寻找 ```python，其次寻找通用的 ```
+        code_block = _extract_last_fence(text, "```python")
+        if code_block is None:
+            code_block = _extract_last_fence(text, _FENCE)
 
         if code_block:
             # 这里的 code_block 保留了第一行的缩进
-            # dedent 会统一去除所有行的公共缩进
-            return textwrap.dedent(code_block).strip()
+            # _dedent 会统一去除所有行的公共缩进
+            return _dedent(code_block).strip()
 
         # 如果没找到 Markdown，尝试处理原文本
-        return textwrap.dedent(text).strip()
+        return _dedent(text).strip()
+
+    def execute_async(self, code_str: str, data_context: Dict[str, Any]) -> "Future[ExecutionResult]":
+        """
+        在线程池中执行代码，立即返回 Future；结果与 execute 相同 (异常已被捕获为 ExecutionResult)。
+        """
+        return self._pool.submit(self.execute, code_str, data_context)
 
     def execute(self, code_str: str, data_context: Dict[str, Any]) -> ExecutionResult:
         """
@@ -72,57 +182,85 @@ class CodeExecutor:
         """
         clean_code = self._clean_code(code_str)
 
-        local_scope = {}
-        old_stdout = sys.stdout
-        redirected_output = io.StringIO()
-        sys.stdout = redirected_output
+        # 同一段代码在同一份数据上再次执行 (自愈第 N 次成功后重问、重复提问) 时直接复用图表
+        cache_key = (clean_code, self._context_token(data_context))
+        with self._fig_lock:
+            fig = self._fig_cache.get(cache_key)
+            if fig is not None:
+                self._fig_cache.move_to_end(cache_key)
+        if fig is not None:
+            logger.info("Figure cache hit, skipping execution.")
+            return ExecutionResult(success=True, result=fig, code=clean_code)
 
+        res = self._run(clean_code, data_context)
+        if res.success:
+            with self._fig_lock:
+                self._fig_cache[cache_key] = res.result
+                if len(self._fig_cache) > self._FIG_CACHE_SIZE:
+                    self._fig_cache.popitem(last=False)
+        return res
+
+    @staticmethod
+    def _context_token(data_context: Dict[str, Any]) -> Tuple:
+        """
+        数据上下文的身份标识：优先使用上下文自带的 cache_token (如按文件路径/修改时间生成)，
+        否则退化为各变量对象的 id 与长度。
+        """
+        token = getattr(data_context, "cache_token", None)
+        if token is not None:
+            return token
+        return tuple((k, id(v), len(v) if hasattr(v, "__len__") else None) for k, v in data_context.items())
+
+    def _run(self, clean_code: str, data_context: Dict[str, Any]) -> ExecutionResult:
+        local_scope = {}
         try:
             logger.info("Executing code...")
 
-            # 1. 尝试执行代码定义
+            # 1. 编译一次，并静态判断顶层是否定义了 plot()，只沿选定的分支执行一次
             try:
-                exec(clean_code, self.global_context, local_scope)
+                compiled = _compile(clean_code)
             except SyntaxError as e:
-                sys.stdout = old_stdout
                 return ExecutionResult(False, error=f"SyntaxError (Check indentation or non-code text): {str(e)}",
                                        code=clean_code)
-            except NameError:
-                logger.info("NameError detected during definition phase. Treating as Script Mode.")
-            except Exception as e:
-                raise e
 
-            # 2. 检查 'plot' 函数 (Scaffold)
-            if "plot" in local_scope and callable(local_scope["plot"]):
+            # 生成代码的 print 输出写入本次执行自己的缓冲区：不用 redirect_stdout，
+            # 它替换的是进程级 sys.stdout，多个执行并发时会按错误的顺序恢复。
+            # 绘图代码通常不含 print，此时直接共用 global_context，不复制
+            exec_globals = self.global_context
+            if compiled.has_print:
+                exec_globals = {**self.global_context, "print": _buffered_print(io.StringIO())}
+
+            # 2. Scaffold 模式: 执行定义后调用 plot(data_context)
+            if compiled.has_plot:
                 logger.info("Detected 'plot' function. Executing in Scaffold mode.")
+                exec(compiled.code, exec_globals, local_scope)
+                if not callable(local_scope.get("plot")):
+                    return ExecutionResult(False, error="'plot' is defined but not callable after execution.",
+                                           code=clean_code)
                 try:
                     fig = local_scope["plot"](data_context)
-                    sys.stdout = old_stdout
                     return ExecutionResult(success=True, result=fig, code=clean_code)
-                except Exception as e:
-                    sys.stdout = old_stdout
-                    return ExecutionResult(False, error=f"Runtime Error inside plot(): {traceback.format_exc()}",
+                except Exception:
+                    return ExecutionResult(False, error=f"Runtime Error inside plot(): {_format_user_trace()}",
                                            code=clean_code)
 
-            # 3. Fallback: Script Mode
-            else:
-                logger.info("Function 'plot' not found. Falling back to Script mode.")
-                script_scope = data_context.copy()
-                exec(clean_code, self.global_context, script_scope)
-                sys.stdout = old_stdout
-
-                if "fig" in script_scope:
-                    return ExecutionResult(success=True, result=script_scope["fig"], code=clean_code)
-                else:
-                    return ExecutionResult(
-                        success=False,
-                        error="Code executed but neither 'plot(data_context)' function nor 'fig' variable was found.",
-                        code=clean_code
-                    )
+            # 3. Script Mode: 直接在数据上下文中执行，读取 fig 变量
+            # exec 的赋值只会写入 ChainMap 的第一个映射 (overlay)，data_context 保持原样，无需每次 copy
+            logger.info("Function 'plot' not found. Executing in Script mode.")
+            overlay = {}
+            exec(compiled.code, exec_globals, ChainMap(overlay, data_context))
+
+            fig = overlay.get("fig", data_context.get("fig"))
+            if fig is not None:
+                return ExecutionResult(success=True, result=fig, code=clean_code)
+            return ExecutionResult(
+                success=False,
+                error="Code executed but neither 'plot(data_context)' function nor 'fig' variable was found.",
+                code=clean_code
+            )
 
         except Exception:
-            sys.stdout = old_stdout
-            error_trace = traceback.format_exc()
+            error_trace = _format_user_trace()
             return ExecutionResult(success=False, error=error_trace, code=clean_code)
 
 
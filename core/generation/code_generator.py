@@ -1,20 +1,102 @@
+import hashlib
 import logging
-from typing import Dict, Any, List
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from core.llm.AI_client import AIClient
-from core.generation.scaffold import STChartScaffold
+from core.llm.semantic_cache import SemanticCache
+from core.generation.scaffold import SHARED_SCAFFOLD
 
 logger = logging.getLogger(__name__)
 
+_FRAME_SEP = "\n  File "
+# pandas / plotly / geopandas 内部栈帧对 LLM 修复代码没有帮助
+_LIB_FRAME_RE = re.compile(r'site-packages[\\/](?:pandas|plotly|geopandas)[\\/]')
+
+
+def _condense_trace(trace: str, max_frames: int = 8) -> str:
+    """
+    压缩 Traceback：丢弃第三方库内部栈帧，只保留最后 max_frames 个栈帧和最终的异常信息。
+    """
+    head, *frames = trace.split(_FRAME_SEP)
+    if not frames:
+        return trace
+
+    # 最后一个栈帧块的末尾是异常信息 (首行之后第一个非缩进行开始)
+    lines = frames[-1].split("\n")
+    i = 1
+    while i < len(lines) and lines[i].startswith("    "):
+        i += 1
+    frames[-1] = "\n".join(lines[:i])
+    exception = "\n".join(lines[i:])
+
+    kept = [f for f in frames if not _LIB_FRAME_RE.search(f.split("\n", 1)[0])][-max_frames:] or frames[-1:]
+    omitted = len(frames) - len(kept)
+    note = f"\n  ... ({omitted} library/older frames omitted)" if omitted else ""
+    return head + note + "".join(_FRAME_SEP + f for f in kept) + "\n" + exception
+
 
 class CodeGenerator:
+    # LLM 回复缓存的最大条目数 (LRU 淘汰)
+    _CACHE_SIZE = 128
+
     def __init__(self, llm_client: AIClient):
         self.llm = llm_client
-        self.scaffold = STChartScaffold()
-
-    def generate_code(self, query: str, summaries: List[Dict[str, Any]]) -> str:
+        self.scaffold = SHARED_SCAFFOLD
+        # (请求内容, 系统提示词摘要) -> LLM 回复；自愈循环或重复提问命中时跳过一次网络往返
+        # 流水线线程与自愈修复线程共用此缓存，读写都要加锁
+        self._cache: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._render_columns_hint = lru_cache(maxsize=8)(self._build_columns_hint)
+        # 只差大小写/标点的相同提问直接复用已生成的代码 (fix_code 依赖具体报错，不走该缓存)
+        self._semantic_cache = SemanticCache()
+
+    @staticmethod
+    def _summaries_fingerprint(summaries: List[Dict[str, Any]]) -> Tuple:
         """
-        利用 Scaffold 生成代码
+        数据摘要的轻量指纹：变量名 + 列名，只用于缓存列名提示。
+        LLM 回复缓存改用系统提示词摘要 (_namespace) 作键，类型或语义标签变化时回复随之失效。
         """
+        return tuple(
+            (s.get('variable_name'), tuple(s.get('basic_stats', {}).get('column_stats', {}).keys()))
+            for s in summaries
+        )
+
+    @staticmethod
+    def _build_columns_hint(fingerprint: Tuple) -> str:
+        lines = ["=== REAL AVAILABLE COLUMNS & VARIABLES ==="]
+        for var_name, columns in fingerprint:
+            columns_str = ", ".join(map(str, columns[:50]))
+            lines.append(f"Variable `{var_name or 'unknown'}` columns: {columns_str}")
+        return "\n".join(lines) + "\n"
+
+    def _cached_chat(self, key: Tuple, messages: List[Dict[str, str]]) -> str:
+        cached = self._lookup(key)
+        if cached is not None:
+            logger.info("LLM cache hit, skipping request.")
+            return cached
+
+        response = self.llm.chat(messages, json_mode=False)
+        self._remember(key, response)
+        return response
+
+    def _lookup(self, key: Tuple) -> Optional[str]:
+        with self._cache_lock:
+            response = self._cache.get(key)
+            if response is not None:
+                self._cache.move_to_end(key)
+            return response
+
+    def _remember(self, key: Tuple, response: str) -> None:
+        with self._cache_lock:
+            self._cache[key] = response
+            self._cache.move_to_end(key)
+            if len(self._cache) > self._CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def _generate_messages(self, query: str, summaries: List[Dict[str, Any]]) -> List[Dict[str, str]]:
         system_prompt = self.scaffold.get_system_prompt(summaries)
         template = self.scaffold.get_template(library="plotly")
 
@@ -29,95 +111,135 @@ class CodeGenerator:
         Return the COMPLETE python code block (including imports and the function).
         """
 
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ]
 
-        logger.info(f"Generating code with scaffold for: '{query}'...")
-        return self.llm.chat(messages, json_mode=False)
+    @staticmethod
+    def _namespace(messages: List[Dict[str, str]]) -> str:
+        # 系统提示词摘要 (含变量名、列名、类型、语义标签)：数据上下文不同的查询不会互相命中
+        return hashlib.sha1(messages[0]["content"].encode("utf-8")).hexdigest()[:16]
+
+    def generate_code(self, query: str, summaries: List[Dict[str, Any]]) -> str:
+        """
+        利用 Scaffold 生成代码
+        """
+        messages = self._generate_messages(query, summaries)
+
+        namespace = self._namespace(messages)
+        hit = self._semantic_cache.get(namespace, query)
+        if hit is not None:
+            logger.info("Query cache hit for: '%s'", query)
+            return hit
+
+        logger.info("Generating code with scaffold for: '%s'...", query)
+        key = ("generate", query, namespace)
+        response = self._cached_chat(key, messages)
+        self._semantic_cache.set(namespace, query, response)
+        return response
+
+    def generate_code_stream(self, query: str, summaries: List[Dict[str, Any]]) -> Iterator[str]:
+        """
+        流式版本的 generate_code：逐块产出 LLM 回复 (可直接交给 st.write_stream)。
+        命中缓存时一次性产出完整回复；完整接收后写入与 generate_code 相同的缓存。
+        """
+        messages = self._generate_messages(query, summaries)
+        namespace = self._namespace(messages)
+        key = ("generate", query, namespace)
+
+        hit = self._semantic_cache.get(namespace, query)
+        cached = hit if hit is not None else self._lookup(key)
+        if cached is not None:
+            yield cached
+            return
+
+        logger.info("Streaming code with scaffold for: '%s'...", query)
+        chunks = []
+        for chunk in self.llm.chat_stream(messages):
+            chunks.append(chunk)
+            yield chunk
+
+        response = "".join(chunks)
+        self._remember(key, response)
+        self._semantic_cache.set(namespace, query, response)
 
     def fix_code(self, original_code: str, error_trace: str, summaries: List[Dict[str, Any]]) -> str:
         """
         自愈修复方法 (增强版 v5 - 导入修正 + 反逻辑谬误)
         """
+        error_trace = _condense_trace(error_trace)
         system_prompt = self.scaffold.get_system_prompt(summaries)
 
-        # 构建变量名和列名清单
-        available_columns_hint = "=== REAL AVAILABLE COLUMNS & VARIABLES ===\n"
-        for summary in summaries:
-            var_name = summary.get('variable_name', 'unknown')
-            columns = list(summary.get("basic_stats", {}).get("column_stats", {}).keys())
-            columns_str = str(columns[:50])
-            available_columns_hint += f"Variable `{var_name}` columns: {columns_str}\n"
+        # 变量名和列名清单 (按摘要指纹缓存，与系统提示词一样在自愈重试间复用)
+        available_columns_hint = self._render_columns_hint(self._summaries_fingerprint(summaries))
 
-        specific_hint = ""
+        hints: List[str] = []
 
         # [针对 Pandas Drop 错误]
         if "not found in axis" in error_trace and "drop" in original_code:
-            specific_hint += """
+            hints.append("""
            [HINT: DataFrame Column Error]
            - You tried to `.drop()` a column (e.g. LocationID_y) that does not exist.
            - `pd.merge` ONLY adds suffixes (_x, _y) if columns have the SAME name in both dataframes.
            - If `left_on='PULocationID'` and `right_on='LocationID'`, NO suffixes are added. Both columns are kept.
            - FIX: Remove the `.drop()` call. Check `merged_df.columns` logic.
-           """
+           """)
 
         # [针对 Merge 逻辑的优化建议]
         if "pd.merge" in original_code and "groupby" in original_code:
-            specific_hint += """
+            hints.append("""
            [HINT: Optimization & Logic Flow]
            - Current logic (Merge -> Group -> Merge) is risky and slow.
            - BETTER LOGIC: 
              1. Group the Trips DataFrame by ID first: `df_counts = df_trips.groupby('PULocationID')...`
              2. THEN merge with Zones GeoDataFrame: `gdf = df_zones.merge(df_counts, left_on='LocationID', right_on='PULocationID')`
              3. Plot `gdf`.
+           - SIMPLEST: the preloaded helper does both steps in one call:
+             `gdf = aggregate_and_join(df_trips, 'PULocationID', df_zones, 'LocationID')` (adds a 'count' column).
            - This ensures you don't lose the geometry column or confuse column names.
-           """
+           """)
 
         # [新增 1] 针对 导入错误 (ModuleNotFoundError)
         if "No module named" in error_trace:
-            specific_hint += """
+            hints.append("""
             [HINT: Import Error]
             - You likely wrote `import gpd` or similar. THIS IS WRONG.
             - Standard imports ONLY: 
               `import pandas as pd`
               `import geopandas as gpd`
               `import plotly.express as px`
-            """
+            """)
 
         # [新增 2] 针对 几何捏造错误 (points_from_xy 使用了 ID)
         if "points_from_xy" in original_code and ("ID" in original_code or "id" in original_code):
-            specific_hint += """
+            hints.append("""
             [HINT: LOGIC ERROR - DO NOT CREATE GEOMETRY FROM IDs]
             - You are trying to create points/polygons using an ID column (e.g. LocationID). This is IMPOSSIBLE.
             - LocationID is NOT a coordinate.
             - SOLUTION: Merge your data with the Shapefile DataFrame (available in data_context) to get the 'geometry' column.
             - Pattern: `df_map = df_zones_shapefile.merge(df_stats, on='LocationID')`.
-            """
+            """)
 
         # [针对 KeyError]
         if "KeyError" in error_trace:
-            specific_hint += """
+            hints.append("""
             [HINT: KeyError detected] 
             1. LOOK AT THE 'REAL AVAILABLE COLUMNS' LIST ABOVE! 
             2. Check Case Sensitivity ('zone' vs 'Zone').
             3. Check if you lost columns during a merge.
-            """
+            """)
 
         # [针对 幻觉代码]
         if "Example usage" in original_code or "data_context =" in original_code or "plot(data_context)" in original_code:
-            specific_hint += """
+            hints.append("""
             [HINT: Clean Code]
             - Remove `# Example usage`, mock data, or function calls at the bottom.
             - ONLY return the `def plot(data_context):` function.
-            """
-            # [针对 导入错误]
-        if "No module named" in error_trace:
-            specific_hint += "\n[HINT] Use `import geopandas as gpd`.\n"
+            """)
 
-        if "KeyError" in error_trace:
-            specific_hint += "\n[HINT] Check Column Case Sensitivity (e.g. 'Zone' vs 'zone'). Check available columns list.\n"
+        # 去重：同一条提示只保留一次 (保持出现顺序)
+        specific_hint = "\n".join(dict.fromkeys(hints))
 
         fix_prompt = f"""
         The code you generated previously failed to execute.
@@ -143,8 +265,9 @@ class CodeGenerator:
             {"role": "user", "content": fix_prompt}
         ]
 
-        logger.warning(f"Attempting to FIX code based on error...")
-        return self.llm.chat(messages, json_mode=False)
+        logger.warning("Attempting to FIX code based on error...")
+        key = ("fix", original_code, error_trace, self._namespace(messages))
+        return self._cached_chat(key, messages)
 # --- 单元测试 ---
 if __name__ == "__main__":
     print("=== Testing Code Generator with Scaffold ===")
@@ -1,14 +1,27 @@
+import hashlib
 import logging
 import json
-from typing import Dict, Any, List
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple
 from core.llm.AI_client import AIClient
+from core.llm.semantic_cache import SemanticCache
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=64)
+def _bucketize(tag_items: Tuple[Tuple[str, str], ...]) -> Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]:
+    """按语义标签把列分为 (指标, 分类, 时间) 三组"""
+    metrics = tuple(col for col, tag in tag_items if tag in ("BIZ_METRIC", "BIZ_PRICE"))
+    cats = tuple(col for col, tag in tag_items if tag in ("BIZ_CAT", "ST_LOC_ID"))
+    times = tuple(col for col, tag in tag_items if tag == "ST_TIME")
+    return metrics, cats, times
+
+
 class GoalExplorer:
     def __init__(self, llm_client: AIClient):
         self.llm = llm_client
+        self._semantic_cache = SemanticCache()
 
     def generate_goals(self, summary: Dict[str, Any], n: int = 4) -> List[str]:
         """
@@ -18,10 +31,8 @@ class GoalExplorer:
         tags = summary.get("semantic_analysis", {}).get("semantic_tags", {})
         file_name = summary.get("file_info", {}).get("name", "data")
 
-        # 简单的启发式规则：提取可用于分析的列
-        metrics = [col for col, tag in tags.items() if tag in ["BIZ_METRIC", "BIZ_PRICE"]]
-        cats = [col for col, tag in tags.items() if tag in ["BIZ_CAT", "ST_LOC_ID"]]
-        times = [col for col, tag in tags.items() if tag == "ST_TIME"]
+        # 简单的启发式规则：提取可用于分析的列 (按标签集合缓存)
+        metrics, cats, times = (list(bucket) for bucket in _bucketize(tuple(tags.items())))
 
         # 构建 Prompt
         prompt = f"""
@@ -43,22 +54,32 @@ class GoalExplorer:
         ["Plot histogram of fare_amount", "Show monthly trend of trips", "Scatter plot distance vs price"]
         """
 
+        # 以 Prompt 摘要为命名空间 (列角色与数量 n 都已包含在内)，文件名作为查询文本
+        namespace = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:16]
+        hit = self._semantic_cache.get(namespace, file_name)
+        if hit is not None:
+            logger.info("Semantic cache hit for goals of '%s'", file_name)
+            return list(hit)
+
         try:
             logger.info("Generating analysis goals...")
             # 调用 LLM (JSON 模式)
             response = self.llm.query_json(prompt, system_prompt="You output strictly JSON lists.")
 
             # 兼容性处理：如果返回的是字典 {"goals": [...] }
+            goals = []
             if isinstance(response, dict):
                 # 尝试寻找列表类型的 value
                 for val in response.values():
                     if isinstance(val, list):
-                        return val
-                return []
+                        goals = val
+                        break
             elif isinstance(response, list):
-                return response
-            else:
-                return []
+                goals = response
+
+            if goals:
+                self._semantic_cache.set(namespace, file_name, tuple(goals))
+            return goals
 
         except Exception as e:
             logger.error(f"Goal exploration failed: {e}")
@@ -1,101 +1,16 @@
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple
 
 
-class STChartScaffold:
-    """
-    Spatio-Temporal Chart Scaffold
-    管理时空可视化的 Prompt 模板、专家规则和代码食谱 (Recipes)。
-    """
-
-    def __init__(self):
-        # 通用 GIS 处理指令 (经过强化和去重)
-        self.common_gis_instructions = """
-        [CRITICAL RULES - READ CAREFULLY]
-        1. **NO DISK I/O**: `data_context` ALREADY contains loaded DataFrame/GeoDataFrame OBJECTS. 
-           - NEVER write `pd.read_csv(...)` or `gpd.read_file(...)`.
-           - CORRECT USAGE: `df = data_context['df_variable_name']`.
-
-        2. **CASE SENSITIVITY**: Pandas is case-sensitive! 
-           - NYC Data usually uses capitalized names: 'Zone', 'Borough', 'LocationID'.
-           - ERROR: 'zone' -> CORRECT: 'Zone'.
-           - Check the 'AVAILABLE DATASETS' list for exact column names.
-
-        3. **GEOMETRY SOURCE**: 
-           - To plot a map, you MUST use the GeoDataFrame (loaded from Shapefile), NOT the lookup CSV.
-           - The lookup CSV (e.g., taxi_zone_lookup) has NO geometry column.
-           - Logic: Aggregate data -> Merge into GeoDataFrame -> Plot GeoDataFrame.
-
-        4. **NO MOCK DATA / NO EXTRA CODE**: 
-           - DO NOT include `data_context = ...` or example usage at the bottom of the script.
-           - ONLY define the `def plot(data_context):` function.
-           - The system will call the function automatically.
-
-        5. **Coordinate System**: Plotly Mapbox REQUIRES WGS84 (EPSG:4326). 
-           - EXECUTE: `gdf = gdf.to_crs(epsg=4326)` BEFORE plotting.
-
-        6. **Map Matching**: 
-           - When using `px.choropleth_mapbox`, Plotly matches `locations` against the GeoJSON feature IDs.
-           - CRITICAL STEP: Set the matching column as index: `gdf = gdf.set_index('LocationID')`.
-           - Then use: `locations=gdf.index`.
-
-        7. **Map Style**: ALWAYS set `mapbox_style="carto-positron"` (no token needed).
-        
-        8. **ANIMATION SORTING (CRITICAL)**: 
-           - Sampling (`df.sample()`) shuffles data!
-           - You MUST sort the dataframe by the animation column (`sort_values()`) AFTER sampling and IMMEDIATELY BEFORE plotting.
-           - Otherwise, the timeline will be chaotic.
-        """
-
-    def get_template(self, library: str = "plotly") -> str:
-        """返回 Python 代码的骨架 (Skeleton)"""
-        if library == "plotly":
-            return """
-import plotly.express as px
-import pandas as pd
-import geopandas as gpd
-
-def plot(data_context: dict):
-    # 1. Extract DataFrames (Use exact keys from Available Datasets)
-    # Example: df_trips = data_context['df_trips']
-
-    # <stub> 
-    # (Write your data processing and plotting code here)
-
-    return fig
-"""
-        return ""
-
-    def get_system_prompt(self, summaries: List[Dict[str, Any]]) -> str:
-        """构建包含“食谱”的系统提示词"""
-
-        # 1. 构建数据上下文描述
-        context_descriptions = []
-        for summary in summaries:
-            var_name = summary.get('variable_name', 'df')
-            file_name = summary.get('file_info', {}).get('name', 'unknown')
-
-            # 提取列信息
-            cols = []
-            stats = summary.get("basic_stats", {}).get("column_stats", {})
-            tags = summary.get("semantic_analysis", {}).get("semantic_tags", {})
-            for col, info in stats.items():
-                tag = tags.get(col, "UNKNOWN")
-                cols.append(f"  - {col} ({info.get('dtype')}, {tag})")
-
-            desc = f"DataFrame `{var_name}` (Source: {file_name}):\n" + "\n".join(cols)
-            context_descriptions.append(desc)
-
-        full_context = "\n\n".join(context_descriptions)
-
-        # 2. 构建 Prompt
-        prompt = f"""
+# 系统提示词的静态部分 (模块加载时构建一次)，只留 {full_context} / {gis_instructions} 两个占位符
+_SYSTEM_PROMPT_TEMPLATE = """
         You are an expert Python GIS Data Analyst. 
         Your task is to complete the `plot(data_context)` function to visualize data using `plotly.express`.
 
         === AVAILABLE DATASETS (in `data_context`) ===
         {full_context}
 
-        {self.common_gis_instructions}
+        {gis_instructions}
 
         === RECIPES (Reference Patterns) ===
 
@@ -109,13 +24,9 @@ def plot(data_context: dict):
             df_trips = data_context['df_trips']
             df_zones = data_context['df_zones'] # Expecting GeoDataFrame
 
-            # 2. Aggregate
+            # 2-3. Aggregate by ID, then join onto the GeoDataFrame (keeps geometry)
             # Note: Using LocationID for grouping is safer than names
-            df_agg = df_trips.groupby('PULocationID')['fare_amount'].sum().reset_index()
-
-            # 3. Merge (Left merge on GeoDataFrame to keep geometry)
-            # Ensure columns match (e.g. LocationID vs PULocationID)
-            df_map = df_zones.merge(df_agg, left_on='LocationID', right_on='PULocationID', how='left')
+            df_map = aggregate_and_join(df_trips, 'PULocationID', df_zones, 'LocationID', value_col='fare_amount')
 
             # 4. Transform CRS (CRITICAL!)
             df_map = df_map.to_crs(epsg=4326)
@@ -162,7 +73,10 @@ def plot(data_context: dict):
         def plot(data_context):
             df = data_context['df_trips']
             # CRITICAL: Sample to avoid browser crash
-            if len(df) > 20000: df = df.sample(20000)
+            # Draw 20k row positions directly (no full-index shuffle like df.sample), then re-sort (Rule 8)
+            if len(df) > 20000:
+                idx = np.random.default_rng(42).choice(len(df), 20000, replace=False)
+                df = df.iloc[idx].sort_values('tpep_pickup_datetime')
 
             fig = px.scatter_mapbox(
                 df, lat='pickup_latitude', lon='pickup_longitude',
@@ -177,4 +91,147 @@ def plot(data_context: dict):
         2. Merge dataframes if needed.
         3. Return ONLY the python code inside the markdown block.
         """
-        return prompt
\ No newline at end of file
+
+
+class STChartScaffold:
+    """
+    Spatio-Temporal Chart Scaffold
+    管理时空可视化的 Prompt 模板、专家规则和代码食谱 (Recipes)。
+    """
+
+    # 系统提示词中每个数据集最多列出的列数
+    MAX_PROMPT_COLUMNS = 40
+
+    def __init__(self):
+        # 通用 GIS 处理指令 (经过强化和去重)
+        self.common_gis_instructions = """
+        [CRITICAL RULES - READ CAREFULLY]
+        1. **NO DISK I/O**: `data_context` ALREADY contains loaded DataFrame/GeoDataFrame OBJECTS. 
+           - NEVER write `pd.read_csv(...)` or `gpd.read_file(...)`.
+           - CORRECT USAGE: `df = data_context['df_variable_name']`.
+
+        2. **CASE SENSITIVITY**: Pandas is case-sensitive! 
+           - NYC Data usually uses capitalized names: 'Zone', 'Borough', 'LocationID'.
+           - ERROR: 'zone' -> CORRECT: 'Zone'.
+           - Check the 'AVAILABLE DATASETS' list for exact column names.
+
+        3. **GEOMETRY SOURCE**: 
+           - To plot a map, you MUST use the GeoDataFrame (loaded from Shapefile), NOT the lookup CSV.
+           - The lookup CSV (e.g., taxi_zone_lookup) has NO geometry column.
+           - Logic: Aggregate data -> Merge into GeoDataFrame -> Plot GeoDataFrame.
+
+        4. **NO MOCK DATA / NO EXTRA CODE**: 
+           - DO NOT include `data_context = ...` or example usage at the bottom of the script.
+           - ONLY define the `def plot(data_context):` function.
+           - The system will call the function automatically.
+
+        5. **Coordinate System**: Plotly Mapbox REQUIRES WGS84 (EPSG:4326). 
+           - EXECUTE: `gdf = gdf.to_crs(epsg=4326)` BEFORE plotting.
+
+        6. **Map Matching**: 
+           - When using `px.choropleth_mapbox`, Plotly matches `locations` against the GeoJSON feature IDs.
+           - CRITICAL STEP: Set the matching column as index: `gdf = gdf.set_index('LocationID')`.
+           - Then use: `locations=gdf.index`.
+
+        7. **Map Style**: ALWAYS set `mapbox_style="carto-positron"` (no token needed).
+        
+        8. **ANIMATION SORTING (CRITICAL)**: 
+           - Sampling shuffles data! Prefer `df.iloc[np.random.default_rng(42).choice(len(df), k, replace=False)]` over `df.sample(k)` on large frames.
+           - You MUST sort the dataframe by the animation column (`sort_values()`) AFTER sampling and IMMEDIATELY BEFORE plotting.
+           - Otherwise, the timeline will be chaotic.
+
+        9. **FAST NUMERIC HELPERS**: A module named `fast_ops` is ALREADY available (do NOT import it).
+           - Pairwise distances (km): `df['dist_km'] = fast_ops.haversine_pairs(df['lat1'], df['lon1'], df['lat2'], df['lon2'])`
+             (Numba-compiled, ~50x faster than `.apply(haversine)`; NEVER loop over rows for distances).
+           - 2D grid counts: `counts = fast_ops.bin_2d(df['lon'], df['lat'], xmin, xmax, ymin, ymax, nx, ny)` -> array of shape (nx, ny).
+           - Counts per integer ID (e.g. trips per zone), instead of `groupby(...).size()`:
+             `counts = fast_groupby_count(df_trips['PULocationID'].values, df_trips['PULocationID'].max() + 1)` -> counts[id]
+             (`fast_groupby_count` is also preloaded; IDs must be non-negative integers without NaN).
+           - Aggregate facts onto zones in ONE call (count, or sum with `value_col`), geometry is kept:
+             `df_map = aggregate_and_join(df_trips, 'PULocationID', df_zones, 'LocationID')` -> adds column 'count'
+             `df_map = aggregate_and_join(df_trips, 'PULocationID', df_zones, 'LocationID', value_col='fare_amount')`
+        """
+
+        # 系统提示词按摘要指纹缓存：同一会话内 summaries 基本不变，自愈重试无需重复拼接；
+        # 返回同一个字符串对象，多次请求的 Prompt 前缀逐字节一致，便于服务端复用前缀缓存 (KV cache)
+        # 进程内所有会话共享同一个 scaffold 实例，容量按多会话并存设置
+        self._render_system_prompt = lru_cache(maxsize=32)(self._build_system_prompt)
+
+    def get_template(self, library: str = "plotly") -> str:
+        """返回 Python 代码的骨架 (Skeleton)"""
+        if library == "plotly":
+            return """
+import plotly.express as px
+import pandas as pd
+import geopandas as gpd
+import numpy as np
+
+def plot(data_context: dict):
+    # 1. Extract DataFrames (Use exact keys from Available Datasets)
+    # Example: df_trips = data_context['df_trips']
+
+    # <stub> 
+    # (Write your data processing and plotting code here)
+
+    return fig
+"""
+        return ""
+
+    @staticmethod
+    def _summaries_fingerprint(summaries: List[Dict[str, Any]]) -> Tuple:
+        """提取 Prompt 用到的全部字段 (变量名、文件名、列名/类型/语义标签)，作为可哈希的缓存键"""
+        fingerprint = []
+        for summary in summaries:
+            # SemanticAnalyzer 生成摘要时已展开好 (列名, 类型, 标签)；旧缓存中没有时再现场推导
+            prebuilt = summary.get("_prebuilt_columns")
+            if prebuilt is not None:
+                columns = tuple(map(tuple, prebuilt))
+            else:
+                stats = summary.get("basic_stats", {}).get("column_stats", {})
+                tag_get = summary.get("semantic_analysis", {}).get("semantic_tags", {}).get
+                columns = tuple((col, str(info.get('dtype')), tag_get(col, "UNKNOWN")) for col, info in stats.items())
+            fingerprint.append((
+                summary.get('variable_name', 'df'),
+                summary.get('file_info', {}).get('name', 'unknown'),
+                columns,
+            ))
+        return tuple(fingerprint)
+
+    @staticmethod
+    def _format_columns(columns: Tuple) -> str:
+        """
+        宽表只列出前 MAX_PROMPT_COLUMNS 列 (有语义标签的列优先，其余保持原顺序)，
+        剩余列折叠为一行计数，减少 Prompt Token 与 LLM 预填充耗时。
+        """
+        if len(columns) > STChartScaffold.MAX_PROMPT_COLUMNS:
+            columns = sorted(columns, key=lambda c: c[2] == "UNKNOWN")
+            n_extra = len(columns) - STChartScaffold.MAX_PROMPT_COLUMNS
+            columns = columns[:STChartScaffold.MAX_PROMPT_COLUMNS]
+        else:
+            n_extra = 0
+
+        lines = "\n".join(f"  - {col} ({dtype}, {tag})" for col, dtype, tag in columns)
+        if n_extra:
+            lines += f"\n  - ... and {n_extra} more columns"
+        return lines
+
+    def get_system_prompt(self, summaries: List[Dict[str, Any]]) -> str:
+        """构建包含“食谱”的系统提示词"""
+        return self._render_system_prompt(self._summaries_fingerprint(summaries))
+
+    def _build_system_prompt(self, fingerprint: Tuple) -> str:
+        # 1. 构建数据上下文描述 (每个数据集一次 join，不生成中间列表)
+        full_context = "\n\n".join(
+            f"DataFrame `{var_name}` (Source: {file_name}):\n" + self._format_columns(columns)
+            for var_name, file_name, columns in fingerprint
+        )
+
+        # 2. 填充模块级 Prompt 模板
+        prompt = _SYSTEM_PROMPT_TEMPLATE.format(full_context=full_context,
+                                                gis_instructions=self.common_gis_instructions)
+        return prompt
+
+
+# 进程内共享的 Scaffold 实例：CodeGenerator 与 VizEditor 共用同一个系统提示词缓存，
+# 生成后紧跟着的编辑请求可直接复用已拼好的 Prompt
+SHARED_SCAFFOLD = STChartScaffold()
@@ -1,7 +1,7 @@
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List
 from core.llm.AI_client import AIClient
-from core.generation.scaffold import STChartScaffold
+from core.generation.scaffold import SHARED_SCAFFOLD
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +14,7 @@ class VizEditor:
 
     def __init__(self, aIClient: AIClient):
         self.llm = aIClient
-        self.scaffold = STChartScaffold()
+        self.scaffold = SHARED_SCAFFOLD
 
     def edit_code(self, original_code: str, query: str, summaries: List[Dict[str, Any]]) -> str:
         """
@@ -23,7 +23,21 @@ class VizEditor:
             query: 用户的修改指令 (例如 "把颜色改成红色")
             summaries: 数据摘要 (用于上下文理解)
         """
+        messages = self._build_messages(original_code, query, summaries)
 
+        logger.info("Editing code based on query: '%s'...", query)
+
+        # 调用 LLM
+        response_text = self.llm.chat(messages, json_mode=False)
+        return response_text
+
+    def edit_code_stream(self, original_code: str, query: str, summaries: List[Dict[str, Any]]) -> Iterator[str]:
+        """流式版本的 edit_code：逐块产出修改后的代码 (可直接交给 st.write_stream)"""
+        messages = self._build_messages(original_code, query, summaries)
+        logger.info("Streaming code edit for query: '%s'...", query)
+        yield from self.llm.chat_stream(messages)
+
+    def _build_messages(self, original_code: str, query: str, summaries: List[Dict[str, Any]]) -> List[Dict[str, str]]:
         # 1. 获取基础上下文 (复用 Scaffold 以保持 GIS 规则一致性)
         # 我们只需要其中的 GIS 规则部分，或者完整的 system prompt
         base_system_prompt = self.scaffold.get_system_prompt(summaries)
@@ -57,13 +71,7 @@ class VizEditor:
         Return the complete modified Python code block (including imports).
         """
 
-        messages = [
+        return [
             {"role": "system", "content": editor_system_prompt},
             {"role": "user", "content": user_prompt}
-        ]
-
-        logger.info(f"Editing code based on query: '{query}'...")
-
-        # 4. 调用 LLM
-        response_text = self.llm.chat(messages, json_mode=False)
-        return response_text
\ No newline at end of file
+        ]
\ No newline at end of file
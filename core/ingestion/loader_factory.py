@@ -1,7 +1,9 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import geopandas as gpd
-from typing import Union, Dict, Optional, Type
+from functools import lru_cache
+from typing import Union, Dict, List, Optional, Type
 from pathlib import Path
 import logging
 
@@ -36,6 +38,9 @@ class BaseLoader:
 class CsvLoader(BaseLoader):
     """处理 .csv, .txt 文件"""
 
+    # peek 使用的最小块大小
+    _MIN_BLOCK = 1 << 16
+
     def load(self, file_path: str, **kwargs) -> pd.DataFrame:
         try:
             # 自动推断分隔符（简单的嗅探逻辑）
@@ -46,17 +51,62 @@ class CsvLoader(BaseLoader):
             raise
 
     def peek(self, file_path: str, n: int = 5) -> pd.DataFrame:
-        # 优化：只读取前 n 行，避免大文件内存爆炸
-        return pd.read_csv(file_path, nrows=n)
+        # 优化：用 pyarrow 流式读取，解析到 n 行即停止，避免大文件内存爆炸
+        try:
+            import pyarrow as pa
+            import pyarrow.csv as pacsv
+        except ImportError:
+            return pd.read_csv(file_path, nrows=n)
 
-    def count_rows(self, file_path: str) -> int:
-        # 优化：仅读取第一列来计数，极大减少内存消耗
         try:
-            # 这里的 usecols=[0] 确保我们只读一列
-            df = pd.read_csv(file_path, usecols=[0])
-            return len(df)
-        except Exception:
-            return len(pd.read_csv(file_path))
+            block_size = self._estimate_block_size(file_path, n)
+            # 只需一个块时 (如 5~10 行的语义推断样本) 不启用线程池预读，避免额外调度开销
+            read_options = pacsv.ReadOptions(block_size=block_size, use_threads=block_size > self._MIN_BLOCK)
+            # 与 load 的 pd.read_csv 保持一致 (LLM 的 Prompt 由样本生成，类型不一致会让生成代码在全量模式下报错)：
+            # - 字符串列里的空单元格同样视为缺失值 (pandas 读成 NaN，而非 "")
+            # - 日期/时间列保持字符串 (pandas 不会自动解析)。类型由首个块推断，
+            #   推断出时间类型时按列名改回 string 重新打开；timestamp_parsers=[] 仍会启用内置 ISO-8601 解析，无法关闭推断
+            convert_options = pacsv.ConvertOptions(strings_can_be_null=True)
+            reader = pacsv.open_csv(file_path, read_options=read_options, convert_options=convert_options)
+            temporal = {f.name: pa.string() for f in reader.schema if pa.types.is_temporal(f.type)}
+            if temporal:
+                convert_options.column_types = temporal
+                reader = pacsv.open_csv(file_path, read_options=read_options, convert_options=convert_options)
+            batches, rows = [], 0
+            for batch in reader:
+                batches.append(batch)
+                rows += batch.num_rows
+                if rows >= n:
+                    break
+            table = pa.Table.from_batches(batches, schema=reader.schema)
+            return table.slice(0, n).to_pandas()
+        except pa.ArrowInvalid as e:
+            # 后续块类型推断不一致等情况，回退到 pandas
+            logger.warning(f"PyArrow CSV peek failed for {file_path}, falling back to pandas: {e}")
+            return pd.read_csv(file_path, nrows=n)
+
+    @staticmethod
+    def _estimate_block_size(file_path: str, n: int) -> int:
+        """根据文件头部的平均行宽估算容纳 n 行所需的块大小"""
+        with open(file_path, 'rb') as f:
+            head = f.read(1 << 16)
+        avg_row_bytes = len(head) / max(head.count(b'\n'), 1)
+        # 下限 64KB，上限 256MB (pyarrow block_size 为 int32)
+        return int(min(max(avg_row_bytes * (n + 1) * 1.2, CsvLoader._MIN_BLOCK), 1 << 28))
+
+    def count_rows(self, file_path: str) -> int:
+        # 优化：不解析 CSV，按 1MB 分块统计换行符 (bytes.count 基于 memchr，接近内存带宽)
+        # 注意：引号内含换行的字段会被多计；该计数仅用于数据摘要中的规模估计
+        count, last = 0, b'\n'
+        with open(file_path, 'rb', buffering=0) as f:
+            read = f.read
+            while chunk := read(1 << 20):
+                count += chunk.count(b'\n')
+                last = chunk[-1:]
+        # 最后一行没有换行符时补上；减去表头
+        if last != b'\n':
+            count += 1
+        return max(count - 1, 0)
 
 
 class ExcelLoader(BaseLoader):
@@ -72,33 +122,89 @@ class ExcelLoader(BaseLoader):
     def peek(self, file_path: str, n: int = 5) -> pd.DataFrame:
         return pd.read_excel(file_path, nrows=n)
 
+    def count_rows(self, file_path: str) -> int:
+        # .xlsx 的工作表 XML 开头记录了数据区域 (dimension)，只读模式下无需解析单元格
+        if Path(file_path).suffix.lower() == '.xlsx':
+            try:
+                from openpyxl import load_workbook
+                wb = load_workbook(file_path, read_only=True)
+                try:
+                    max_row = wb.worksheets[0].max_row  # 与 read_excel 默认一致，只看第一个工作表
+                finally:
+                    wb.close()
+                if max_row:
+                    return max(max_row - 1, 0)  # 减去表头
+            except Exception as e:
+                logger.warning(f"Excel dimension lookup failed for {file_path}, loading instead: {e}")
+        return super().count_rows(file_path)
+
+
+@lru_cache(maxsize=128)
+def _parquet_metadata(file_path: str, mtime: float):
+    """按 (路径, 修改时间) 缓存 Parquet footer，重复的数据画像调用不再重新 seek"""
+    import pyarrow.parquet as pq
+    return pq.read_metadata(file_path)
+
 
 class ParquetLoader(BaseLoader):
     """处理 .parquet 文件 (高性能)"""
 
     def load(self, file_path: str, **kwargs) -> pd.DataFrame:
         try:
-            return pd.read_parquet(file_path, **kwargs)
+            import pyarrow.parquet as pq
+            # memory_map 直接读取页缓存，多线程解压；self_destruct 逐列转换并释放 Arrow 缓冲区，
+            # 避免 Arrow 表与 DataFrame 同时驻留内存造成峰值翻倍 (kwargs 如 columns/filters 透传给 read_table)
+            table = pq.read_table(file_path, memory_map=True, use_threads=True, **kwargs)
+            return table.to_pandas(split_blocks=True, self_destruct=True)
         except Exception as e:
             logger.error(f"Failed to load Parquet {file_path}: {e}")
             raise
 
-    # Parquet 格式支持通过 pyarrow 快速读取 schema，这里暂时用 pandas 接口
     def peek(self, file_path: str, n: int = 5) -> pd.DataFrame:
-        # read_parquet 不支持 nrows，但 Parquet 本身是列式存储，读取通常很快
-        # 如果文件巨大，建议使用 pyarrow.parquet.read_table(limit=n) 优化
-        df = pd.read_parquet(file_path)
-        return df.head(n)
-
-    def count_rows(self, file_path: str) -> int:
-        # Parquet 格式在元数据里存了行数，读取速度极快，无需读取内容
+        # read_parquet 不支持 nrows，改用 pyarrow 按批流式读取，凑够 n 行即停止，
+        # 不会解码样本范围之外的 row group
         try:
+            import pyarrow as pa
             import pyarrow.parquet as pq
-            metadata = pq.read_metadata(file_path)
-            return metadata.num_rows
         except ImportError:
-            # 如果没装 pyarrow，回退到 pandas 读取
-            return len(pd.read_parquet(file_path, columns=[]))
+            return pd.read_parquet(file_path).head(n)
+
+        # memory_map: 只有被读取的 row group 页会真正载入内存
+        pf = pq.ParquetFile(file_path, memory_map=True)
+        batches, rows = [], 0
+        for batch in pf.iter_batches(batch_size=n):
+            batches.append(batch)
+            rows += batch.num_rows
+            if rows >= n:
+                break
+        table = pa.Table.from_batches(batches, schema=pf.schema_arrow).slice(0, n)
+        # split_blocks 避免把同类型列合并成大块再拷贝；self_destruct 边转换边释放 Arrow 缓冲区
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+
+    def count_rows(self, file_path: str) -> int:
+        # Parquet 格式在元数据里存了行数，只需读取文件尾部的 footer，无需读取内容
+        # (pyarrow 是 geopandas/pyogrio 的依赖，这里不再回退到 pandas)
+        return _parquet_metadata(os.path.abspath(file_path), os.path.getmtime(file_path)).num_rows
+
+
+def warm_wgs84_transformer(crs) -> None:
+    """
+    预热 crs -> EPSG:4326 的坐标转换器。
+    GeoDataFrame.to_crs 内部经 geopandas.array.TransformerFromCRS (lru_cache 包装的 Transformer.from_crs)
+    取转换器，这里用与 to_crs 完全相同的参数调用一次，生成代码中的 to_crs(epsg=4326) 即可命中缓存，
+    不必在绘图时再付 PROJ 数据库查询的开销。
+    """
+    try:
+        from geopandas.array import TransformerFromCRS
+        from pyproj import CRS
+    except ImportError:
+        # 旧版本 geopandas 没有该缓存，交给 to_crs 自行构建
+        return
+    try:
+        TransformerFromCRS(crs, CRS.from_epsg(4326), always_xy=True)
+    except Exception as e:
+        # 预热失败不影响加载，to_crs 时会给出真正的错误
+        logger.debug(f"Failed to warm WGS84 transformer for {crs}: {e}")
 
 
 class ShapefileLoader(BaseLoader):
@@ -106,32 +212,93 @@ class ShapefileLoader(BaseLoader):
 
     def load(self, file_path: str, **kwargs) -> gpd.GeoDataFrame:
         try:
-            gdf = gpd.read_file(file_path, **kwargs)
+            gdf = self._read(file_path, **kwargs)
 
             # 检查坐标系，如果缺失则发出警告
             if gdf.crs is None:
                 logger.warning(f"⚠️ Warning: {Path(file_path).name} has NO projection (CRS).")
             else:
-                logger.info(f"Loaded geospatial data with CRS: {gdf.crs.to_string()}")
+                logger.info("Loaded geospatial data with CRS: %s", gdf.crs)
+                # 生成的绘图代码几乎都会 to_crs(epsg=4326)
+                warm_wgs84_transformer(gdf.crs)
 
             return gdf
         except Exception as e:
             logger.error(f"Failed to load Spatial Data {file_path}: {e}")
             raise
 
+    @staticmethod
+    def _read(file_path: str, **kwargs) -> gpd.GeoDataFrame:
+        """
+        优先走 pyogrio + Arrow 的列式读取 (GDAL 批量填充列缓冲区)，
+        避免 Fiona 逐要素构造 Python dict 的开销。
+        """
+        try:
+            return gpd.read_file(file_path, engine="pyogrio", use_arrow=True, **kwargs)
+        except (TypeError, ImportError, ValueError):
+            # 兼容旧版本 GeoPandas / 未安装 pyogrio 或 pyarrow 的环境
+            if "max_features" in kwargs:
+                kwargs["rows"] = kwargs.pop("max_features")
+            return gpd.read_file(file_path, **kwargs)
+
     def peek(self, file_path: str, n: int = 5) -> gpd.GeoDataFrame:
-        # gpd.read_file 支持 rows 参数 (Geopandas >= 0.11.0)
+        # pyogrio 用 max_features 只读取前 n 个要素；回退到默认引擎时 _read 会改用 rows 参数 (Geopandas >= 0.11.0)
         try:
-            return gpd.read_file(file_path, rows=n)
+            return self._read(file_path, max_features=n)
         except TypeError:
             # 兼容旧版本
             return gpd.read_file(file_path).head(n)
 
     def count_rows(self, file_path: str) -> int:
-        # GeoPandas 读取需要一点时间，但通常 Shapefile 不会太大
-        # 为了避免读取复杂的 geometry，我们可以只读属性表 (.dbf)
-        # 但为了代码简单，这里暂时直接读取，后续可优化为只读 dbf
-        return len(gpd.read_file(file_path, ignore_geometry=True))
+        # Shapefile 的记录数存放在 .dbf 头部 (第 4~7 字节，小端 uint32)，读 8 个字节即可
+        dbf = Path(file_path).with_suffix('.dbf')
+        if Path(file_path).suffix.lower() == '.shp' and dbf.exists():
+            with open(dbf, 'rb') as f:
+                header = f.read(8)
+            if len(header) == 8:
+                return int.from_bytes(header[4:8], 'little')
+        return self._count_features(file_path)
+
+    @staticmethod
+    def _count_features(source: str) -> int:
+        """GeoJSON/GPKG 等格式：通过 OGR 图层元数据获取要素数，避免构造 GeoDataFrame"""
+        try:
+            import pyogrio
+            features = pyogrio.read_info(source)['features']
+            if features >= 0:
+                return int(features)
+        except ImportError:
+            pass
+        # 驱动无法直接给出要素数 (-1) 或未安装 pyogrio：只读属性表计数
+        return len(gpd.read_file(source, ignore_geometry=True))
+
+
+class ZipShapefileLoader(ShapefileLoader):
+    """
+    处理打包成 .zip 的 Shapefile。
+    通过 GDAL 的 /vsizip/ 虚拟文件系统直接在压缩包内读取，无需解压到磁盘。
+    """
+
+    @staticmethod
+    def _read(file_path: str, **kwargs) -> gpd.GeoDataFrame:
+        abs_path = os.path.abspath(file_path)
+        try:
+            return gpd.read_file(f"/vsizip/{abs_path}", engine="pyogrio", use_arrow=True, **kwargs)
+        except (TypeError, ImportError, ValueError):
+            # Fiona 使用 zip:// 前缀访问压缩包
+            if "max_features" in kwargs:
+                kwargs["rows"] = kwargs.pop("max_features")
+            return gpd.read_file(f"zip://{abs_path}", **kwargs)
+
+    def peek(self, file_path: str, n: int = 5) -> gpd.GeoDataFrame:
+        return self._read(file_path, max_features=n)
+
+    def count_rows(self, file_path: str) -> int:
+        try:
+            return self._count_features(f"/vsizip/{os.path.abspath(file_path)}")
+        except Exception:
+            # 旧版 GDAL/Fiona 环境无法识别 /vsizip/ 时，只读属性表计数
+            return len(self._read(file_path, ignore_geometry=True))
 
 
 class LoaderFactory:
@@ -146,21 +313,44 @@ class LoaderFactory:
         '.shp': ShapefileLoader,
         '.geojson': ShapefileLoader,
         '.gpkg': ShapefileLoader,
-        '.kml': ShapefileLoader
+        '.kml': ShapefileLoader,
+        '.zip': ZipShapefileLoader
     }
 
+    # 扩展名 -> 加载器实例 (加载器无状态，可在线程与调用之间共享)
+    _instances: Dict[str, BaseLoader] = {}
+
     @classmethod
     def get_loader(cls, file_path: str) -> BaseLoader:
         """根据文件路径获取对应的加载器实例"""
         ext = Path(file_path).suffix.lower()
 
-        loader_class = cls._loaders.get(ext)
-        if not loader_class:
-            # 默认为 CSV 加载器，或者抛出不支持的异常
-            logger.warning(f"Unknown extension '{ext}', defaulting to CSV loader.")
-            return CsvLoader()
+        loader = cls._instances.get(ext)
+        if loader is None:
+            loader_class = cls._loaders.get(ext)
+            if not loader_class:
+                # 默认为 CSV 加载器，或者抛出不支持的异常
+                logger.warning(f"Unknown extension '{ext}', defaulting to CSV loader.")
+                loader_class = CsvLoader
+            # 并发首次访问时最多多建一个实例，setdefault 保证之后都拿到同一个
+            loader = cls._instances.setdefault(ext, loader_class())
+
+        return loader
+
+    @classmethod
+    def load_many(cls, paths: List[str], max_workers: int = 8) -> Dict[str, DataType]:
+        """
+        并行加载多个文件，返回 {路径: DataFrame}。
+        pyarrow / pyogrio / pandas 的 C 解析器在解析期间会释放 GIL，总耗时接近最慢的单个文件。
+        """
+        if not paths:
+            return {}
+
+        def _load(path):
+            return cls.get_loader(path).load(path)
 
-        return loader_class()
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as pool:
+            return dict(zip(paths, pool.map(_load, paths)))
 
 
 # --- 单元测试/使用示例 ---
@@ -1,203 +1,120 @@
-# import requests
-# import json
-# import logging
-# from typing import Dict, List, Optional, Any, Union
-#
-# # 配置简单的日志
-# logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-# logger = logging.getLogger(__name__)
-#
-#
-# class AIClient:
-#     """
-#     与本地部署的 Ollama 服务进行交互的客户端。
-#     主要用于处理 Llama 3.1 的 API 请求，特别是 JSON 格式的结构化输出。
-#     """
-#
-#     def __init__(self,
-#                  base_url: str = "http://localhost:11434",
-#                  model_name: str = "llama3.1:latest",
-#                  timeout: int = 120):
-#         """
-#         初始化客户端。
-#
-#         Args:
-#             base_url: Ollama API 地址，默认为 http://localhost:11434
-#             model_name: 模型名称，需与 'ollama list' 中的名称一致
-#             timeout: 请求超时时间（秒），处理大文件摘要时建议设置较长
-#         """
-#         self.base_url = base_url.rstrip('/')
-#         self.model_name = model_name
-#         self.timeout = timeout
-#         self.api_chat_endpoint = f"{self.base_url}/api/chat"
-#
-#         # 初始化检查
-#         if not self.is_alive():
-#             logger.warning(f"无法连接到 Ollama 服务 ({self.base_url})。请确保 Ollama 正在运行。")
-#         else:
-#             logger.info(f"Ollama 服务连接成功，使用模型: {self.model_name}")
-#
-#     def is_alive(self) -> bool:
-#         """检查 Ollama 服务是否健康"""
-#         try:
-#             response = requests.get(self.base_url, timeout=5)
-#             return response.status_code == 200
-#         except requests.RequestException:
-#             return False
-#
-#     def chat(self, messages: List[Dict[str, str]], json_mode: bool = False) -> str:
-#         """
-#         发送聊天请求并获取回复内容。
-#
-#         Args:
-#             messages: 消息列表，格式如 [{"role": "user", "content": "..."}]
-#             json_mode: 是否强制模型输出 JSON 格式 (Ollama 原生支持)
-#
-#         Returns:
-#             str: 模型的回复文本
-#         """
-#         payload = {
-#             "model": self.model_name,
-#             "messages": messages,
-#             "stream": False  # 关闭流式输出，便于一次性获取完整结果
-#         }
-#
-#         if json_mode:
-#             payload["format"] = "json"
-#
-#         try:
-#             response = requests.post(
-#                 self.api_chat_endpoint,
-#                 json=payload,
-#                 timeout=self.timeout
-#             )
-#             response.raise_for_status()
-#
-#             result = response.json()
-#             return result.get('message', {}).get('content', '')
-#
-#         except requests.RequestException as e:
-#             logger.error(f"LLM 请求失败: {e}")
-#             raise ConnectionError(f"Failed to communicate with Ollama: {e}")
-#
-#     def query_json(self, prompt: str, system_prompt: str = "You are a helpful data assistant.") -> Dict[str, Any]:
-#         """
-#         专门用于获取 JSON 结构化数据的的高级方法。
-#         包含自动清洗 Markdown 标记的逻辑。
-#
-#         Args:
-#             prompt: 用户的指令
-#             system_prompt: 系统设定
-#
-#         Returns:
-#             dict: 解析后的 Python 字典
-#         """
-#         messages = [
-#             {"role": "system", "content": system_prompt},
-#             {"role": "user", "content": prompt}
-#         ]
-#
-#         raw_response = self.chat(messages, json_mode=True)
-#
-#         # 数据清洗：有时候模型即使在 JSON 模式下也会包裹 ```json ... ```
-#         clean_response = self._clean_markdown(raw_response)
-#
-#         try:
-#             return json.loads(clean_response)
-#         except json.JSONDecodeError:
-#             logger.error(f"JSON 解析失败。原始返回: {raw_response}")
-#             # 这里可以添加重试逻辑 (Phase 2 实现)
-#             raise ValueError("LLM 未返回有效的 JSON 格式")
-#
-#     def _clean_markdown(self, text: str) -> str:
-#         """去除可能存在的 Markdown 代码块标记"""
-#         text = text.strip()
-#         if text.startswith("```json"):
-#             text = text[7:]
-#         if text.startswith("```"):
-#             text = text[3:]
-#         if text.endswith("```"):
-#             text = text[:-3]
-#         return text.strip()
-#
-#
-# # --- 单元测试/使用示例 ---
-# if __name__ == "__main__":
-#     # 简单的测试脚本，直接运行此文件可验证连接
-#     print("正在测试本地 Ollama 连接...")
-#
-#     client = AIClient(model_name="llama3.1:latest")
-#
-#     # 1. 测试普通对话
-#     try:
-#         reply = client.chat([{"role": "user", "content": "Say hello to NL-STV project!"}])
-#         print(f"\n[普通对话测试]\nAI: {reply}")
-#     except Exception as e:
-#         print(f"普通对话测试失败: {e}")
-#
-#     # 2. 测试 JSON 提取 (这是后续功能的核心)
-#     print("\n[JSON 提取测试]")
-#     test_prompt = """
-#     Analyze this file metadata:
-#     Filename: nyc_taxi_2025.csv
-#     Columns: pickup_lat, pickup_lon, fare_amount
-#
-#     Return a JSON with "file_type" and "columns_detected".
-#     """
-#
-#     try:
-#         json_result = client.query_json(test_prompt)
-#         print("解析结果:", json.dumps(json_result, indent=2))
-#
-#         if "file_type" in json_result:
-#             print("✅ JSON 测试通过")
-#         else:
-#             print("❌ JSON 结构不符合预期")
-#
-#     except Exception as e:
-#         print(f"JSON 测试失败: {e}")
-# 
+import asyncio
 import json
 import logging
-from typing import Dict, List, Any
-from openai import OpenAI, APIError, AuthenticationError, APIConnectionError
+import threading
+import weakref
+from typing import AsyncIterator, Dict, Iterator, List, Any, Optional
+
+import httpx
+from openai import (OpenAI, AsyncOpenAI, APIError, AuthenticationError, APIConnectionError, APITimeoutError,
+                    InternalServerError, RateLimitError)
+
+try:
+    from core.llm.base import BaseLLMClient
+except ImportError:
+    # 兼容直接运行此脚本时的路径问题
+    import sys
+    from pathlib import Path
+
+    sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+    from core.llm.base import BaseLLMClient
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 进程内所有 AIClient 共享的 HTTP 连接池：复用已建立的 TCP/TLS 连接，省去每个请求的握手
+_HTTP_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=60.0)
+_HTTP_SYNC = httpx.Client(limits=_HTTP_LIMITS, timeout=httpx.Timeout(120.0, connect=10.0))
+# httpx.AsyncClient 绑定在事件循环上，按循环各建一个并在所有 AIClient 之间共享
+_HTTP_ASYNC: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+# 每个循环上持有 AsyncOpenAI (即在用共享异步连接池) 的 AIClient；最后一个使用者 aclose 时才关闭连接池
+_HTTP_ASYNC_USERS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, weakref.WeakSet]" = \
+    weakref.WeakKeyDictionary()
+
+
+# 共享连接池每个进程只需预热一次
+_WARMUP_LOCK = threading.Lock()
+_WARMED = False
 
-class AIClient:
+
+def _async_http_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    http = _HTTP_ASYNC.get(loop)
+    if http is None:
+        http = httpx.AsyncClient(limits=_HTTP_LIMITS, timeout=httpx.Timeout(120.0, connect=10.0))
+        _HTTP_ASYNC[loop] = http
+    return http
+
+
+class AIClient(BaseLLMClient):
     """
     使用 OpenAI SDK 封装 DeepSeek API 的客户端。
-    保持与原 OllamaClient 相同的方法签名，以确保业务代码兼容性。
+    与 LocalLlamaClient 共用 BaseLLMClient 的 JSON 封装，这里只实现 OpenAI SDK 上的传输。
     """
 
     def __init__(self,
                  api_key: str = "",  # 在这里输入KEY
                  model_name: str = "deepseek-chat",  # deepseek-chat (V3)
-                 timeout: int = 120):
+                 timeout: int = 120,
+                 request_timeout: float = 60,
+                 max_output_tokens: int = 4096,
+                 json_max_tokens: int = 2048,
+                 max_retries: int = 3):
         """
         初始化 DeepSeek 客户端。
 
         Args:
             api_key: DeepSeek API Key
             model_name: 模型名称 (deepseek-chat 或 deepseek-reasoner)
-            timeout: 请求超时时间
+            timeout: 请求超时时间 (超时重试时使用的宽松上限)
+            request_timeout: 单次请求的常规超时；超时后以 timeout 为期限再重试一次
+            max_output_tokens: 普通对话 (代码生成/修复) 的最大输出 Token 数
+            json_max_tokens: JSON 模式的最大输出 Token 数 (结构化结果较紧凑)
+            max_retries: SDK 对连接错误、429、5xx 的自动重试次数 (异步与流式请求)；
+                同步 chat 不用 SDK 重试，只自行重试一次，以限定整次调用的总耗时
         """
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url="https://api.deepseek.com",
-            timeout=timeout
-        )
+        self.timeout = timeout
+        self.request_timeout = request_timeout
+        self.max_output_tokens = max_output_tokens
+        self.json_max_tokens = json_max_tokens
+        self._client_kwargs = {
+            "api_key": api_key,
+            "base_url": "https://api.deepseek.com",
+            "timeout": timeout,
+            "max_retries": max_retries,
+        }
+        self.client = OpenAI(**self._client_kwargs, http_client=_HTTP_SYNC)
+        # AsyncOpenAI 的连接池绑定在创建它的事件循环上，按循环各建一个 (循环结束后自动回收)
+        self._aclients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = \
+            weakref.WeakKeyDictionary()
         self.model_name = model_name
 
         logger.info(f"AI Client (DeepSeek via OpenAI SDK) 初始化完成，使用模型: {self.model_name}")
+        self._start_warmup()
+
+    def _start_warmup(self) -> None:
+        """
+        在后台线程里发一个廉价请求 (models.list)，提前完成 DNS 解析与 TCP/TLS 握手，
+        首个真实请求直接复用共享池 (_HTTP_SYNC) 里的热连接。进程内只做一次，失败不影响使用。
+        """
+        global _WARMED
+        with _WARMUP_LOCK:
+            if _WARMED:
+                return
+            _WARMED = True
+        threading.Thread(target=self._warmup, name="deepseek-warmup", daemon=True).start()
+
+    def _warmup(self) -> None:
+        try:
+            self.client.with_options(max_retries=0, timeout=5.0).models.list()
+        except Exception as e:
+            logger.debug(f"DeepSeek 连接预热失败 (忽略): {e}")
 
-    def is_alive(self) -> bool:
+    def _probe(self) -> bool:
         """
         连通性测试。
-        通过调用 list models 接口来验证 API Key 和网络连接。
+        通过调用 list models 接口来验证 API Key 和网络连接 (由 is_alive 按 TTL 缓存)。
         """
         try:
             self.client.models.list()
@@ -212,6 +129,24 @@ class AIClient:
             logger.error(f"健康检查失败: {e}")
             return False
 
+    def _chat_params(self, messages: List[Dict[str, str]], json_mode: bool,
+                     timeout: Optional[float] = None) -> Dict[str, Any]:
+        """构造请求参数 (同步与异步请求共用)"""
+        params = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": False,
+            "temperature": 0.0,  # 固定为确定性输出：JSON 更稳定，且结果可被上层缓存复用
+            # 限制输出长度，避免失控的长回复耗尽整个超时
+            "max_tokens": self.json_max_tokens if json_mode else self.max_output_tokens,
+            "timeout": timeout or self.request_timeout,
+        }
+
+        # 启用 JSON Mode (DeepSeek 支持 OpenAI 格式的 json_object)
+        if json_mode:
+            params["response_format"] = {"type": "json_object"}
+        return params
+
     def chat(self, messages: List[Dict[str, str]], json_mode: bool = False) -> str:
         """
         发送聊天请求。
@@ -221,20 +156,16 @@ class AIClient:
             json_mode: 是否强制输出 JSON 格式
         """
         try:
-            # 构造请求参数
-            params = {
-                "model": self.model_name,
-                "messages": messages,
-                "stream": False,
-                "temperature": 0.0 if json_mode else 0.7,  # JSON 模式通常需要更确定的输出
-            }
-
-            # 启用 JSON Mode (DeepSeek 支持 OpenAI 格式的 json_object)
-            if json_mode:
-                params["response_format"] = {"type": "json_object"}
-
-            # 发起请求
-            response = self.client.chat.completions.create(**params)
+            # 同步调用无法像 achat 那样用 wait_for 限定墙钟时间，因此两次尝试都关闭 SDK 重试
+            # (否则 max_retries × request_timeout 再加一次 timeout，单次调用可能阻塞约 6 分钟)：
+            # 先以常规超时请求；超时、连接错误、429、5xx 时放宽期限再试一次，总耗时不超过 request_timeout + timeout
+            client = self.client.with_options(max_retries=0)
+            try:
+                response = client.chat.completions.create(**self._chat_params(messages, json_mode))
+            except (APIConnectionError, RateLimitError, InternalServerError) as e:
+                logger.warning(f"DeepSeek 请求失败 ({type(e).__name__})，以 {self.timeout}s 期限重试一次")
+                response = client.chat.completions.create(
+                    **self._chat_params(messages, json_mode, timeout=self.timeout))
 
             # 获取内容
             content = response.choices[0].message.content
@@ -247,42 +178,98 @@ class AIClient:
             logger.error(f"LLM 请求发生未知错误: {e}")
             raise e
 
-    def query_json(self, prompt: str, system_prompt: str = "You are a helpful data assistant.") -> Dict[str, Any]:
+    def _async_client(self) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        aclient = self._aclients.get(loop)
+        if aclient is None:
+            aclient = AsyncOpenAI(**self._client_kwargs, http_client=_async_http_client())
+            self._aclients[loop] = aclient
+            _HTTP_ASYNC_USERS.setdefault(loop, weakref.WeakSet()).add(self)
+        return aclient
+
+    async def aclose(self) -> None:
         """
-        获取 JSON 结构化数据的高级封装。
+        释放本实例在当前事件循环上的 AsyncOpenAI (在循环结束前调用)。
+        共享连接池按使用者计数：同一循环上的其他 AIClient 仍持有客户端时保持打开，最后一个使用者释放时才关闭。
         """
-        # DeepSeek/OpenAI 要求：使用 json_mode 时，Prompt 中必须包含 "json" 字样
-        if "json" not in system_prompt.lower() and "json" not in prompt.lower():
-            system_prompt += " Please output the result strictly in JSON format."
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt}
-        ]
+        loop = asyncio.get_running_loop()
+        if self._aclients.pop(loop, None) is None:
+            return
+        users = _HTTP_ASYNC_USERS.get(loop)
+        if users is not None:
+            users.discard(self)
+            if users:
+                return
+            del _HTTP_ASYNC_USERS[loop]
+        http = _HTTP_ASYNC.pop(loop, None)
+        if http is not None:
+            await http.aclose()
 
-        # 调用 chat 获取原始字符串
-        raw_response = self.chat(messages, json_mode=True)
+    async def achat(self, messages: List[Dict[str, str]], json_mode: bool = False) -> str:
+        """chat 的异步版本，多个请求可通过 asyncio.gather 并发执行"""
+        aclient = self._async_client()
+        try:
+            # wait_for 限定整次调用 (含 SDK 内部重试) 的墙钟时间，单个卡住的请求不会拖住整批
+            try:
+                response = await asyncio.wait_for(
+                    aclient.chat.completions.create(**self._chat_params(messages, json_mode)),
+                    timeout=self.request_timeout)
+            except (asyncio.TimeoutError, APITimeoutError):
+                logger.warning(f"DeepSeek 请求超过 {self.request_timeout}s，以 {self.timeout}s 期限重试一次")
+                response = await asyncio.wait_for(
+                    aclient.with_options(max_retries=0).chat.completions.create(
+                        **self._chat_params(messages, json_mode, timeout=self.timeout)),
+                    timeout=self.timeout)
+            return response.choices[0].message.content
+        except asyncio.TimeoutError:
+            logger.error(f"DeepSeek 请求在 {self.timeout}s 内仍未返回")
+            raise ConnectionError(f"DeepSeek API Error: request timed out after {self.timeout}s")
+        except APIError as e:
+            logger.error(f"DeepSeek API 返回错误: {e}")
+            raise ConnectionError(f"DeepSeek API Error: {e}")
 
-        # 数据清洗 (防止 Markdown 包裹)
-        clean_response = self._clean_markdown(raw_response)
+    async def astream_chat(self, messages: List[Dict[str, str]], json_mode: bool = False) -> AsyncIterator[str]:
+        """
+        异步流式聊天 (可启用 JSON Mode)：逐块产出回复文本，调用方可以边接收边解析，
+        例如 SemanticAnalyzer.astream_analyze 逐列产出语义标签。
+        """
+        params = self._chat_params(messages, json_mode)
+        params["stream"] = True
+        try:
+            stream = await self._async_client().chat.completions.create(**params)
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except APIError as e:
+            logger.error(f"DeepSeek API 返回错误: {e}")
+            raise ConnectionError(f"DeepSeek API Error: {e}")
 
+    def chat_stream(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """
+        流式聊天：逐块产出回复文本，前端可在收到首个 token 时就开始展示。
+        参数与 chat 相同 (用于代码生成，不启用 JSON Mode)。
+        """
+        params = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": True,
+            "temperature": 0.0,
+            "max_tokens": self.max_output_tokens,
+            "timeout": self.request_timeout,
+        }
         try:
-            return json.loads(clean_response)
-        except json.JSONDecodeError:
-            logger.error(f"JSON 解析失败。原始返回: {raw_response}")
-            raise ValueError("LLM 未返回有效的 JSON 格式")
-
-    def _clean_markdown(self, text: str) -> str:
-        """去除可能存在的 Markdown 代码块标记 (```json ... ```)"""
-        text = text.strip()
-        if text.startswith("```json"):
-            text = text[7:]
-        elif text.startswith("```"):
-            text = text[3:]
-
-        if text.endswith("```"):
-            text = text[:-3]
-        return text.strip()
+            for chunk in self.client.chat.completions.create(**params):
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except APIError as e:
+            logger.error(f"DeepSeek API 返回错误: {e}")
+            raise ConnectionError(f"DeepSeek API Error: {e}")
 
 
 # --- 单元测试 ---
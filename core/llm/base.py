@@ -0,0 +1,121 @@
+"""
+LLM 客户端的公共基类。
+
+JSON 结构化输出的封装 (消息构造、Markdown 清洗、orjson 解析) 只在这里实现一次，
+各模型提供方 (DeepSeek / 本地 Ollama) 只需实现传输相关的 chat、_probe (以及可选的 achat)。
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, Any
+
+try:
+    # orjson 解析速度是标准库的数倍；其 JSONDecodeError 继承自 json.JSONDecodeError
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+# is_alive 结果的缓存时间 (秒)
+_ALIVE_TTL = 30.0
+
+# 整段回复被 ```json ... ``` 包裹时取出中间部分 (一次匹配完成，结尾围栏可缺省)
+_MD_FENCE_RE = re.compile(r"\A\s*```(?i:json)?\s*(?P<body>.*?)\s*(?:```)?\s*\Z", re.DOTALL)
+
+
+class BaseLLMClient(ABC):
+    """所有 LLM 客户端的基类：子类提供 model_name 属性并实现 chat / _probe"""
+
+    model_name: str
+
+    # 最近一次连通性探测的结果与时间
+    _alive_value = None
+    _alive_checked_at = float("-inf")
+
+    @abstractmethod
+    def _probe(self) -> bool:
+        """实际的连通性探测 (一次网络请求)"""
+
+    def is_alive(self) -> bool:
+        """连通性测试；结果缓存 _ALIVE_TTL 秒，频繁调用 (如测试中反复构造客户端) 不会每次都请求服务端"""
+        if time.monotonic() - self._alive_checked_at >= _ALIVE_TTL:
+            self._mark_alive(self._probe())
+        return self._alive_value
+
+    def _mark_alive(self, alive: bool) -> None:
+        """记录连通状态 (成功的真实请求同样可以证明服务可用)"""
+        self._alive_value = alive
+        self._alive_checked_at = time.monotonic()
+
+    @abstractmethod
+    def chat(self, messages: List[Dict[str, str]], json_mode: bool = False) -> str:
+        """
+        发送聊天请求并返回回复文本。
+
+        Args:
+            messages: 消息列表 [{"role": "user", "content": "..."}]
+            json_mode: 是否强制输出 JSON 格式
+        """
+
+    async def achat(self, messages: List[Dict[str, str]], json_mode: bool = False) -> str:
+        """chat 的异步版本；默认放到线程中执行，有原生异步传输的子类应覆盖"""
+        return await asyncio.to_thread(self.chat, messages, json_mode)
+
+    async def astream_chat(self, messages: List[Dict[str, str]], json_mode: bool = False) -> AsyncIterator[str]:
+        """流式返回回复文本片段；默认实现一次性产出完整回复，支持流式传输的子类应覆盖"""
+        yield await self.achat(messages, json_mode)
+
+    async def aclose(self) -> None:
+        """释放当前事件循环上的异步资源 (默认无需处理)"""
+
+    def query_json(self, prompt: str, system_prompt: str = "You are a helpful data assistant.") -> Dict[str, Any]:
+        """
+        获取 JSON 结构化数据的高级封装。
+        """
+        # 调用 chat 获取原始字符串
+        raw_response = self.chat(self.json_messages(prompt, system_prompt), json_mode=True)
+        return self.parse_json(raw_response)
+
+    async def aquery_json(self, prompt: str,
+                          system_prompt: str = "You are a helpful data assistant.") -> Dict[str, Any]:
+        """query_json 的异步版本"""
+        raw_response = await self.achat(self.json_messages(prompt, system_prompt), json_mode=True)
+        return self.parse_json(raw_response)
+
+    @staticmethod
+    def json_messages(prompt: str, system_prompt: str) -> List[Dict[str, str]]:
+        """构造 JSON 模式请求的消息列表 (流式调用方可配合 astream_chat 与 parse_json 使用)"""
+        # DeepSeek/OpenAI 要求：使用 json_mode 时，Prompt 中必须包含 "json" 字样
+        if "json" not in system_prompt.lower() and "json" not in prompt.lower():
+            system_prompt += " Please output the result strictly in JSON format."
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+
+    def parse_json(self, raw_response: str) -> Dict[str, Any]:
+        """把 JSON 模式的回复文本解析为字典；不是有效 JSON 时抛出 ValueError"""
+        # 数据清洗：有时候模型即使在 JSON 模式下也会包裹 ```json ... ```
+        clean_response = self._clean_markdown(raw_response)
+
+        try:
+            return _json_loads(clean_response)
+        except json.JSONDecodeError:
+            logger.error(f"JSON 解析失败。原始返回: {raw_response}")
+            raise ValueError("LLM 未返回有效的 JSON 格式")
+
+    @staticmethod
+    def _clean_markdown(text: str) -> str:
+        """去除可能存在的 Markdown 代码块标记 (```json ... ```)"""
+        # JSON Mode 下模型通常直接返回 JSON，没有围栏时跳过正则
+        if "```" not in text:
+            return text.strip()
+        m = _MD_FENCE_RE.match(text)
+        return (m.group("body") if m else text).strip()
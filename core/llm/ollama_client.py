@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+import weakref
+from typing import Any, AsyncIterator, Dict, List
+
+import httpx
+
+try:
+    from core.llm.base import BaseLLMClient
+except ImportError:
+    # 兼容直接运行此脚本时的路径问题
+    import sys
+    from pathlib import Path
+
+    sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+    from core.llm.base import BaseLLMClient
+
+logger = logging.getLogger(__name__)
+
+try:
+    # HTTP/2 需要可选依赖 h2；缺失时 httpx 使用 HTTP/1.1 长连接
+    import h2  # noqa: F401
+
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+_OLLAMA_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+
+
+class LocalLlamaClient(BaseLLMClient):
+    """
+    与本地部署的 Ollama 服务进行交互的客户端。
+    主要用于处理 Llama 3.1 的 API 请求，可作为 DeepSeek 不可用时的备用模型 (SemanticAnalyzer.fallback_llm)。
+    """
+
+    def __init__(self,
+                 base_url: str = "http://localhost:11434",
+                 model_name: str = "llama3.1:latest",
+                 timeout: int = 120):
+        """
+        初始化客户端。
+
+        Args:
+            base_url: Ollama API 地址，默认为 http://localhost:11434
+            model_name: 模型名称，需与 'ollama list' 中的名称一致
+            timeout: 请求超时时间（秒），处理大文件摘要时建议设置较长
+        """
+        self.base_url = base_url.rstrip('/')
+        self.model_name = model_name
+        self.timeout = timeout
+        self.api_chat_endpoint = f"{self.base_url}/api/chat"
+        # 长连接复用，避免每个请求都重新建立 TCP 连接
+        self._http = httpx.Client(base_url=self.base_url, timeout=timeout, limits=_OLLAMA_LIMITS, http2=_HTTP2)
+        # httpx.AsyncClient 绑定在事件循环上，按循环各建一个 (循环结束后自动回收)
+        self._ahttp: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = \
+            weakref.WeakKeyDictionary()
+        # 不在构造时探测服务 (省去一次往返)；首个请求成功时再记录连接状态
+
+    def _probe(self) -> bool:
+        """检查 Ollama 服务是否健康 (由 is_alive 按 TTL 缓存)"""
+        try:
+            response = self._http.get("/", timeout=5)
+            alive = response.status_code == 200
+        except httpx.HTTPError:
+            alive = False
+        if not alive:
+            logger.warning(f"无法连接到 Ollama 服务 ({self.base_url})。请确保 Ollama 正在运行。")
+        return alive
+
+    def chat(self, messages: List[Dict[str, str]], json_mode: bool = False) -> str:
+        """
+        发送聊天请求并获取回复内容。
+
+        Args:
+            messages: 消息列表，格式如 [{"role": "user", "content": "..."}]
+            json_mode: 是否强制模型输出 JSON 格式 (Ollama 原生支持)
+
+        Returns:
+            str: 模型的回复文本
+        """
+        try:
+            response = self._http.post("/api/chat", json=self._payload(messages, json_mode))
+            response.raise_for_status()
+
+            result = response.json()
+            self._on_success()
+            return result.get('message', {}).get('content', '')
+
+        except httpx.HTTPError as e:
+            logger.error(f"LLM 请求失败: {e}")
+            raise ConnectionError(f"Failed to communicate with Ollama: {e}")
+
+    async def achat(self, messages: List[Dict[str, str]], json_mode: bool = False) -> str:
+        """chat 的异步版本，SemanticAnalyzer 并发分析时直接走 httpx.AsyncClient"""
+        try:
+            response = await self._async_http().post("/api/chat", json=self._payload(messages, json_mode))
+            response.raise_for_status()
+            result = response.json()
+            self._on_success()
+            return result.get('message', {}).get('content', '')
+        except httpx.HTTPError as e:
+            logger.error(f"LLM 请求失败: {e}")
+            raise ConnectionError(f"Failed to communicate with Ollama: {e}")
+
+    async def astream_chat(self, messages: List[Dict[str, str]], json_mode: bool = False) -> AsyncIterator[str]:
+        """异步流式聊天：Ollama 以 NDJSON 逐行返回增量内容"""
+        payload = self._payload(messages, json_mode)
+        payload["stream"] = True
+        try:
+            async with self._async_http().stream("POST", "/api/chat", json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    delta = json.loads(line).get('message', {}).get('content')
+                    if delta:
+                        yield delta
+            self._on_success()
+        except httpx.HTTPError as e:
+            logger.error(f"LLM 请求失败: {e}")
+            raise ConnectionError(f"Failed to communicate with Ollama: {e}")
+
+    def _on_success(self) -> None:
+        if self._alive_value is None:
+            logger.info(f"Ollama 服务连接成功，使用模型: {self.model_name}")
+        self._mark_alive(True)
+
+    def _payload(self, messages: List[Dict[str, str]], json_mode: bool) -> Dict[str, Any]:
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": False,  # 关闭流式输出，便于一次性获取完整结果
+            "options": {"temperature": 0.0},  # 与 AIClient 一致：确定性输出
+        }
+
+        if json_mode:
+            payload["format"] = "json"
+        return payload
+
+    def _async_http(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._ahttp.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout,
+                                       limits=_OLLAMA_LIMITS, http2=_HTTP2)
+            self._ahttp[loop] = client
+        return client
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环上的异步连接池 (在循环结束前调用)"""
+        client = self._ahttp.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def close(self) -> None:
+        """关闭同步连接池"""
+        self._http.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+# --- 单元测试/使用示例 ---
+if __name__ == "__main__":
+    # 简单的测试脚本，直接运行此文件可验证连接
+    print("正在测试本地 Ollama 连接...")
+
+    client = LocalLlamaClient(model_name="llama3.1:latest")
+
+    # 1. 测试普通对话
+    try:
+        reply = client.chat([{"role": "user", "content": "Say hello to NL-STV project!"}])
+        print(f"\n[普通对话测试]\nAI: {reply}")
+    except Exception as e:
+        print(f"普通对话测试失败: {e}")
+
+    # 2. 测试 JSON 提取
+    print("\n[JSON 提取测试]")
+    test_prompt = """
+    Analyze this file metadata:
+    Filename: nyc_taxi_2025.csv
+    Columns: pickup_lat, pickup_lon, fare_amount
+
+    Return a JSON with "file_type" and "columns_detected".
+    """
+
+    try:
+        json_result = client.query_json(test_prompt)
+        print("解析结果:", json.dumps(json_result, indent=2))
+
+        if "file_type" in json_result:
+            print("✅ JSON 测试通过")
+        else:
+            print("❌ JSON 结构不符合预期")
+
+    except Exception as e:
+        print(f"JSON 测试失败: {e}")
@@ -0,0 +1,47 @@
+"""
+轻量级查询缓存：LLM 回复按 (命名空间, 规范化后的查询文本) 缓存，措辞上只差大小写、
+空白的重复查询直接复用回复。
+
+只做规范化后的精确匹配，不做相似度匹配：换一个词往往就是换一列
+("pickup" vs "dropoff"、"payment type" vs "vendor type")，相似度再高也是另一张图。
+规范化同样只动大小写与空白：运算符、正负号、小数点都决定筛选条件
+("fare > 50" vs "fare < 50"、"distance 2.5" vs "distance 2-5")，必须原样参与匹配。
+命名空间用于隔离不同的数据上下文 (例如系统提示词的摘要)。
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+
+def _normalize(text: str) -> str:
+    """统一大小写，并把连续空白 (含首尾) 折叠为单个空格；其余字符原样保留"""
+    return " ".join(text.casefold().split())
+
+
+class SemanticCache:
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        # (namespace, 规范化查询) -> 回复；超出容量时淘汰最久未使用的条目
+        self._entries: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, query: str) -> Optional[Any]:
+        """返回缓存的回复；没有完全相同 (规范化后) 的查询时返回 None"""
+        key = (namespace, _normalize(query))
+        if not key[1]:
+            return None
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+            return response
+
+    def set(self, namespace: str, query: str, response: Any) -> None:
+        key = (namespace, _normalize(query))
+        if not key[1]:
+            return
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
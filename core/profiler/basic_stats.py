@@ -1,10 +1,43 @@
 import pandas as pd
 import geopandas as gpd
 import numpy as np
-from typing import Dict, Any, List
+from typing import Dict, Any, List, TypedDict
 
+# 抽取样本值时查看的行数
+_SAMPLE_ROWS = 32
 
-def get_column_stats(df: pd.DataFrame) -> Dict[str, Any]:
+
+class ColumnStat(TypedDict, total=False):
+    """单列统计 (min/max/mean 仅数值列有，geom_type/bounds 仅几何列有)"""
+    dtype: str
+    samples: List[Any]
+    missing_count: int
+    min: float
+    max: float
+    mean: float
+    geom_type: str
+    bounds: List[float]
+
+
+class Fingerprint(TypedDict, total=False):
+    """数据集指纹 (crs 仅 GeoDataFrame 有)"""
+    rows: int
+    cols: int
+    column_stats: Dict[str, ColumnStat]
+    is_geospatial: bool
+    crs: str
+
+
+def _json_native(value: Any) -> Any:
+    """样本值保留 JSON 原生类型 (数值、布尔、字符串)，其余 (Timestamp、geometry 等) 转为字符串"""
+    if isinstance(value, (np.number, np.bool_)):
+        value = value.item()
+    if isinstance(value, (str, bool, int, float)):
+        return value
+    return str(value)
+
+
+def get_column_stats(df: pd.DataFrame) -> Dict[str, ColumnStat]:
     """
     提取每一列的基础统计信息，用于构建 LLM Prompt。
     不涉及复杂计算，重点在于类型、范围和样本值。
@@ -18,46 +51,73 @@ def get_column_stats(df: pd.DataFrame) -> Dict[str, Any]:
     if isinstance(df, gpd.GeoDataFrame) and df.geometry.name not in columns_to_process:
         columns_to_process.append(df.geometry.name)
 
+    # 列级统计一次性批量计算，循环中只做字典组装
+    # (结果都转成普通 dict，循环内按列名查表，不再为每列构造 Series)
+    dtypes = df.dtypes.to_dict()
+    missing = df.isna().sum().to_dict()
+    numeric_cols = [col for col, dtype in dtypes.items() if pd.api.types.is_numeric_dtype(dtype)]
+    numeric_set = set(numeric_cols)
+    try:
+        # {列名: {"min": ..., "max": ..., "mean": ...}}
+        numeric_agg = df[numeric_cols].agg(["min", "max", "mean"]).to_dict() if numeric_cols else {}
+    except Exception:
+        numeric_agg = None  # 极少数列无法整体聚合时，回退为逐列计算
+    # 样本值取自前 N 行 (N 远小于总行数)，不再对每列做一次 dropna
+    head = df.head(_SAMPLE_ROWS).to_dict(orient="list")
+
+    geom_name = df.geometry.name if isinstance(df, gpd.GeoDataFrame) else None
+    geom_info = None
+    if geom_name is not None:
+        bounds = df.total_bounds  # [minx, miny, maxx, maxy]
+        geom_info = {
+            "dtype": "geometry",
+            "geom_type": df.geom_type.mode()[0] if not df.empty else "unknown",
+            "bounds": bounds.tolist() if len(bounds) == 4 else [],
+        }
+
     for col in df.columns:
-        col_type = str(df[col].dtype)
         # 获取非空样本 (最多 3 个)
-        samples = df[col].dropna().head(3).tolist()
-        # 将 timestamp 转字符串以免 JSON 序列化报错
-        samples = [str(s) for s in samples]
+        # 单元格可能是 list/ndarray (pd.isna 会返回数组)，只对标量判空
+        samples = [v for v in head[col] if not (pd.api.types.is_scalar(v) and pd.isna(v))][:3]
+        if len(samples) < 3 and len(df) > _SAMPLE_ROWS and len(df) - missing[col] > len(samples):
+            samples = df[col].dropna().head(3).tolist()  # 前 N 行空值过多时才回到整列查找
+        # 数值保持数值 (Prompt 中显示为 12.5 而非 '12.5')；timestamp 等转字符串以免 JSON 序列化报错
+        samples = [_json_native(s) for s in samples]
 
-        col_info = {
-            "dtype": col_type,
+        col_info: ColumnStat = {
+            "dtype": str(dtypes[col]),
             "samples": samples,
-            "missing_count": int(df[col].isna().sum())
+            "missing_count": int(missing[col])
         }
 
         # 针对数值类型的额外统计
-        if pd.api.types.is_numeric_dtype(df[col]):
+        if col in numeric_set:
             try:
-                col_info["min"] = float(df[col].min())
-                col_info["max"] = float(df[col].max())
-                col_info["mean"] = float(df[col].mean())
+                if numeric_agg is not None:
+                    agg = numeric_agg[col]
+                    col_min, col_max, col_mean = agg["min"], agg["max"], agg["mean"]
+                else:
+                    col_min, col_max, col_mean = df[col].min(), df[col].max(), df[col].mean()
+                col_info["min"] = float(col_min)
+                col_info["max"] = float(col_max)
+                col_info["mean"] = float(col_mean)
             except Exception:
                 pass  # 忽略无法计算的情况
 
         # 针对几何类型的额外统计 (GeoPandas)
-        if isinstance(df, gpd.GeoDataFrame) and col == df.geometry.name:
-            col_info["dtype"] = "geometry"
-            col_info["geom_type"] = df.geom_type.mode()[0] if not df.empty else "unknown"
-            # 获取边界框
-            bounds = df.total_bounds  # [minx, miny, maxx, maxy]
-            col_info["bounds"] = bounds.tolist() if len(bounds) == 4 else []
+        if col == geom_name:
+            col_info.update(geom_info)
 
         stats[col] = col_info
 
     return stats
 
 
-def get_dataset_fingerprint(df: pd.DataFrame) -> Dict[str, Any]:
+def get_dataset_fingerprint(df: pd.DataFrame) -> Fingerprint:
     """
     获取数据集层面的指纹信息
     """
-    fingerprint = {
+    fingerprint: Fingerprint = {
         "rows": len(df),
         "cols": len(df.columns),
         "column_stats": get_column_stats(df)
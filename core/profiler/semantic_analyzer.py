@@ -1,52 +1,48 @@
+import asyncio
+import hashlib
 import json
 import logging
 import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
 
 # 引入我们之前写好的模块
 # 注意：如果运行时提示 ModuleNotFoundError，请确保在项目根目录下运行，或设置 PYTHONPATH
 try:
-    from core.ingestion.loader_factory import LoaderFactory
+    from core.ingestion.loader_factory import LoaderFactory, DataType
     from core.llm.AI_client import AIClient
+    from core.llm.base import BaseLLMClient
     from core.profiler.basic_stats import get_dataset_fingerprint
 except ImportError:
     # 兼容直接运行此脚本时的路径问题
     import sys
 
     sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
-    from core.ingestion.loader_factory import LoaderFactory
+    from core.ingestion.loader_factory import LoaderFactory, DataType
     from core.llm.AI_client import AIClient
+    from core.llm.base import BaseLLMClient
     from core.profiler.basic_stats import get_dataset_fingerprint
 
 logger = logging.getLogger(__name__)
 
+try:
+    # 缓存文件用 orjson 读写 (直接处理 bytes，无需逐字符解码)
+    import orjson
 
-class SemanticAnalyzer:
-    def __init__(self, llm_client: AIClient):
-        self.llm = llm_client
-
-    def _build_prompt(self, filename: str, fingerprint: Dict[str, Any]) -> str:
-        """
-        构建发送给 model的 Prompt (经过幻觉抑制优化)。
-        """
-        # 1. 构建列的详细描述清单
-        columns_summary = []
-        column_names_list = []  # 记录原始列名，用于后续校验
+    _json_loads, _json_dumps = orjson.loads, orjson.dumps
+except ImportError:
+    _json_loads = json.loads
 
-        for col, info in fingerprint["column_stats"].items():
-            column_names_list.append(col)
-            desc = f"Column: '{col}' | Type: {info['dtype']} | Samples: {info['samples']}"
-            if "min" in info:
-                desc += f" | Range: {info['min']:.2f} to {info['max']:.2f}"
-            if "geom_type" in info:
-                desc += f" | Geometry Type: {info['geom_type']}"
-            columns_summary.append(desc)
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
 
-        columns_text = "\n".join(columns_summary)
 
-        # 2. 定义更加精准的语义标签集
-        allowed_tags = """
+# 语义标签集 (更加精准的定义)
+_ALLOWED_TAGS = """
         - ST_TIME: Timestamp, date, datetime (e.g., pickup_time)
         - ST_LOC_ID: Location IDs, Zone IDs (e.g., PULocationID)
         - ST_GEO: Geometry column (WKT, geometry objects)
@@ -59,14 +55,14 @@ class SemanticAnalyzer:
         - OTHER: Anything else
         """
 
-        # 3. 强约束 Prompt
-        prompt = f"""
+# 强约束 Prompt 模板 (模块加载时构建一次)
+_PROMPT_TEMPLATE = """
         You are a Spatial Data Expert. I need you to analyze the schema of a dataset.
 
         === DATASET METADATA ===
         File Name: "{filename}"
-        Rows: {fingerprint['rows']}
-        CRS: {fingerprint.get('crs', 'N/A')}
+        Rows: {rows}
+        CRS: {crs}
 
         === ACTUAL COLUMNS (Use ONLY these names as keys) ===
         {columns_text}
@@ -91,75 +87,382 @@ class SemanticAnalyzer:
             "dataset_type": "TRAJECTORY/GEO_ZONE/LOOKUP_TABLE",
             "description": "Short summary",
             "semantic_tags": {{
-                "{column_names_list[0]}": "TAG",
-                "{column_names_list[1]}": "TAG"
+                "{example_col_0}": "TAG",
+                "{example_col_1}": "TAG"
             }}
         }}
         """
-        return prompt
 
-    def analyze(self, file_path: str) -> Dict[str, Any]:
+def _prompt_key(filename: str, fingerprint: Dict[str, Any]) -> Tuple:
+    """提取 Prompt 用到的全部字段作为可哈希的缓存键 (保持列顺序)"""
+    columns = tuple(
+        (col, info['dtype'], tuple(info['samples']), info.get('min'), info.get('max'), info.get('geom_type'))
+        for col, info in fingerprint["column_stats"].items()
+    )
+    return filename, fingerprint['rows'], fingerprint.get('crs', 'N/A'), columns
+
+
+@lru_cache(maxsize=256)
+def _render_prompt(key: Tuple) -> str:
+    filename, rows, crs, columns = key
+
+    # 1. 构建列的详细描述清单 (每列的片段先收集到列表，最后一次 join)
+    columns_summary = []
+    for col, dtype, samples, col_min, col_max, geom_type in columns:
+        bits = [f"Column: '{col}'", f"Type: {dtype}", f"Samples: {_json_dumps(list(samples)).decode('utf-8')}"]
+        if col_min is not None:
+            bits.append(f"Range: {col_min:.2f} to {col_max:.2f}")
+        if geom_type is not None:
+            bits.append(f"Geometry Type: {geom_type}")
+        columns_summary.append(" | ".join(bits))
+
+    # 2-3. 填充模块级 Prompt 模板 (示例里列出前两个列名)
+    example_cols = ([c[0] for c in columns[:2]] + ["column_name", "column_name"])[:2]
+    return _PROMPT_TEMPLATE.format(
+        filename=filename,
+        rows=rows,
+        crs=crs,
+        columns_text="\n".join(columns_summary),
+        allowed_tags=_ALLOWED_TAGS,
+        example_col_0=example_cols[0],
+        example_col_1=example_cols[1],
+    )
+
+
+# "semantic_tags": {  →  后续的 "列名": "标签" 键值对 (以 } 结束)
+_TAGS_OPEN_RE = re.compile(r'"semantic_tags"\s*:\s*\{')
+_TAG_PAIR_RE = re.compile(r'\s*,?\s*(?:"((?:[^"\\]|\\.)*)"\s*:\s*"((?:[^"\\]|\\.)*)"|(\}))')
+# 已能确定下一项不是 "字符串": "字符串" (如值为 null/对象)
+_TAG_ABORT_RE = re.compile(r'\s*,?\s*(?:"(?:[^"\\]|\\.)*"\s*:\s*[^"\s]|[^"\s,}])')
+
+
+class _TagStreamParser:
+    """
+    从流式到达的 JSON 文本中增量提取 semantic_tags 的键值对。
+    只处理 "列名": "标签" 形式的扁平对象；遇到其他形式就停止增量解析，交给最终的完整解析。
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = None  # semantic_tags 对象内下一个待解析的位置；None 表示尚未出现
+        self._done = False
+        self.seen = set()
+
+    def feed(self, delta: str) -> List[Tuple[str, str]]:
+        self._buf += delta
+        if self._done:
+            return []
+        if self._pos is None:
+            m = _TAGS_OPEN_RE.search(self._buf)
+            if m is None:
+                return []
+            self._pos = m.end()
+
+        pairs = []
+        while True:
+            m = _TAG_PAIR_RE.match(self._buf, self._pos)
+            # 没有匹配即键值对尚未完整到达；若已能看出不是字符串键值对，则放弃增量解析
+            if m is None:
+                self._done = _TAG_ABORT_RE.match(self._buf, self._pos) is not None
+                break
+            self._pos = m.end()
+            if m.group(3):
+                self._done = True
+                break
+            col, tag = json.loads(f'"{m.group(1)}"'), json.loads(f'"{m.group(2)}"')
+            self.seen.add(col)
+            pairs.append((col, tag))
+        return pairs
+
+
+# 语义分析结果的磁盘缓存目录 (项目根目录下)
+_DEFAULT_CACHE_DIR = Path(__file__).resolve().parent.parent.parent / ".cache" / "semantic"
+
+
+class SemanticAnalyzer:
+    _SYSTEM_PROMPT = "You are a data analysis assistant that outputs only valid JSON."
+
+    def __init__(self, llm_client: BaseLLMClient, cache_dir: Optional[Path] = None,
+                 fallback_llm: Optional[BaseLLMClient] = None):
+        self.llm = llm_client
+        # 主模型重试耗尽后改用的备用客户端 (如本地的 LocalLlamaClient)
+        self.fallback_llm = fallback_llm
+        # 按 Prompt 内容寻址的结果缓存：文件的统计指纹不变时跳过 LLM 请求
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else _DEFAULT_CACHE_DIR
+        # analyze_async 的磁盘读取与统计计算专用线程池 (线程按需创建)，
+        # 多个文件的读取彼此并行，并与在途的 LLM 请求重叠
+        self._io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="semantic-io")
+
+    def _build_prompt(self, filename: str, fingerprint: Dict[str, Any]) -> str:
+        """
+        构建发送给 model的 Prompt (经过幻觉抑制优化)。
+        相同的文件名与指纹 (重跑、LLM 失败后重试) 直接返回缓存的字符串。
+        """
+        return _render_prompt(_prompt_key(filename, fingerprint))
+
+    def analyze(self, file_path: str, force: bool = False) -> Dict[str, Any]:
         """
         主入口：分析文件并返回增强后的元数据
+        force=True 时忽略磁盘缓存，重新请求 LLM。
         """
         logger.info(f"Starting semantic analysis for: {file_path}")
 
         try:
             loader = LoaderFactory.get_loader(file_path)
 
-            # Action 1: 获取真实的行数 (全量扫描/元数据读取)
-            real_row_count = loader.count_rows(file_path)
-
-            # Action 2: 获取样本数据 (只取前 10 行给 AI 看)
+            # 获取样本数据 (只取前 10 行给 AI 看)
             df_preview = loader.peek(file_path, n=10)
 
         except Exception as e:
             logger.error(f"Loader failed: {e}")
             return {"error": f"Failed to load file: {str(e)}"}
 
+        return self.analyze_from_sample(df_preview, file_path, force=force)
+
+    def analyze_from_sample(self, df_sample: DataType, file_path: str,
+                            row_count: Optional[int] = None, force: bool = False) -> Dict[str, Any]:
+        """
+        基于调用方已加载的样本 (如 LoaderFactory.peek 的结果) 做分析，不再重复读取数据。
+        row_count 缺省时通过 loader.count_rows 获取 (Parquet 只读 footer 元数据)。
+        """
+        prepared = self._prepare(df_sample, file_path, row_count)
+        if "error" in prepared:
+            return prepared
+
+        # 5. 调用 LLM 获取语义标签 (指纹未变时直接读取缓存)
+        ai_result = None if force else self._load_cached(prepared)
+        if ai_result is None:
+            try:
+                print(f"   >>> Sending metadata of [{prepared['filename']}] to model...")
+                ai_result = self.llm.query_json(prompt=prepared["prompt"], system_prompt=self._SYSTEM_PROMPT)
+                self._store_cached(prepared, ai_result)
+            except Exception as e:
+                logger.error(f"LLM inference failed for {prepared['filename']}: {e}")
+                ai_result = self._query_fallback(prepared)
+
+        return self._merge(file_path, prepared, ai_result)
+
+    async def analyze_async(self, file_path: str, force: bool = False) -> Dict[str, Any]:
+        """
+        analyze 的异步版本：文件读取放到线程中执行，LLM 请求走 AsyncOpenAI，
+        多个文件可通过 analyze_many 并发分析。
+        """
+        prepared = await self._aprepare(file_path)
+        if "error" in prepared:
+            return prepared
+
+        ai_result = None if force else self._load_cached(prepared)
+        if ai_result is None:
+            try:
+                ai_result = await self.llm.aquery_json(prompt=prepared["prompt"], system_prompt=self._SYSTEM_PROMPT)
+                self._store_cached(prepared, ai_result)
+            except Exception as e:
+                logger.error(f"LLM inference failed for {prepared['filename']}: {e}")
+                ai_result = await self._aquery_fallback(prepared)
+
+        return self._merge(file_path, prepared, ai_result)
+
+    async def astream_analyze(self, file_path: str, force: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式分析：LLM 回复边生成边解析，每识别出一列的语义标签就产出
+        {"type": "tag", "column": ..., "tag": ...}，最后产出 {"type": "summary", "summary": ...}
+        (与 analyze_async 的返回值相同)。加载失败时只产出一个 summary (内容为 {"error": ...})。
+        """
+        prepared = await self._aprepare(file_path)
+        if "error" in prepared:
+            yield {"type": "summary", "summary": prepared}
+            return
+
+        ai_result = None if force else self._load_cached(prepared)
+        if ai_result is not None:
+            for col, tag in (ai_result.get("semantic_tags") or {}).items():
+                yield {"type": "tag", "column": col, "tag": tag}
+        else:
+            parser = _TagStreamParser()
+            chunks = []
+            try:
+                messages = self.llm.json_messages(prepared["prompt"], self._SYSTEM_PROMPT)
+                async for delta in self.llm.astream_chat(messages, json_mode=True):
+                    chunks.append(delta)
+                    for col, tag in parser.feed(delta):
+                        yield {"type": "tag", "column": col, "tag": tag}
+                ai_result = self.llm.parse_json("".join(chunks))
+                self._store_cached(prepared, ai_result)
+            except Exception as e:
+                logger.error(f"LLM inference failed for {prepared['filename']}: {e}")
+                ai_result = await self._aquery_fallback(prepared)
+
+            # 最终以完整 JSON 为准，补齐增量解析未覆盖到的列 (如非字符串的值)
+            emitted = parser.seen
+            for col, tag in ((ai_result or {}).get("semantic_tags") or {}).items():
+                if col not in emitted:
+                    yield {"type": "tag", "column": col, "tag": tag}
+
+        yield {"type": "summary", "summary": self._merge(file_path, prepared, ai_result)}
+
+    async def _aprepare(self, file_path: str) -> Dict[str, Any]:
+        """异步读取样本与行数并计算指纹 (均在 I/O 线程池中执行)；失败时返回 {"error": ...}"""
+        logger.info(f"Starting semantic analysis for: {file_path}")
+        loop = asyncio.get_running_loop()
+        try:
+            loader = LoaderFactory.get_loader(file_path)
+            # 读样本与统计行数互不依赖，两个线程同时进行
+            df_preview, row_count = await asyncio.gather(
+                loop.run_in_executor(self._io_pool, loader.peek, file_path, 10),
+                loop.run_in_executor(self._io_pool, loader.count_rows, file_path),
+            )
+        except Exception as e:
+            logger.error(f"Loader failed: {e}")
+            return {"error": f"Failed to load file: {str(e)}"}
+
+        # 统计指纹 (pandas/geopandas 计算) 同样放到线程池，不占用事件循环
+        return await loop.run_in_executor(self._io_pool, self._prepare, df_preview, file_path, row_count)
+
+    def _query_fallback(self, prepared: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        主模型失败 (SDK 已按指数退避重试过连接错误/429/5xx) 后，把同一个 Prompt 交给备用客户端。
+        备用结果不写入磁盘缓存，下次运行仍优先使用主模型。
+        """
+        if self.fallback_llm is None:
+            return None
+        logger.warning(f"Retrying semantic analysis of {prepared['filename']} with fallback LLM")
+        try:
+            return self.fallback_llm.query_json(prompt=prepared["prompt"], system_prompt=self._SYSTEM_PROMPT)
+        except Exception as e:
+            logger.error(f"Fallback LLM inference failed for {prepared['filename']}: {e}")
+            return None
+
+    async def _aquery_fallback(self, prepared: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if self.fallback_llm is None:
+            return None
+        logger.warning(f"Retrying semantic analysis of {prepared['filename']} with fallback LLM")
+        try:
+            return await self.fallback_llm.aquery_json(prompt=prepared["prompt"], system_prompt=self._SYSTEM_PROMPT)
+        except Exception as e:
+            logger.error(f"Fallback LLM inference failed for {prepared['filename']}: {e}")
+            return None
+
+    def _prepare(self, df_sample: DataType, file_path: str, row_count: Optional[int]) -> Dict[str, Any]:
+        """计算行数与统计指纹并构建 Prompt；失败时返回 {"error": ...}"""
+        # Action 1: 获取真实的行数 (全量扫描/元数据读取)
+        if row_count is None:
+            try:
+                row_count = LoaderFactory.get_loader(file_path).count_rows(file_path)
+            except Exception as e:
+                logger.error(f"Loader failed: {e}")
+                return {"error": f"Failed to load file: {str(e)}"}
+
         # 3. 计算基础统计指纹
         try:
-            fingerprint = get_dataset_fingerprint(df_preview)
+            fingerprint = get_dataset_fingerprint(df_sample)
 
             # [关键修正]：用真实行数覆盖样本行数！
-            fingerprint['rows'] = real_row_count
+            fingerprint['rows'] = row_count
 
         except Exception as e:
             logger.error(f"Fingerprinting failed: {e}")
             return {"error": f"Failed to generate stats: {str(e)}"}
 
-        # 4. 构建 Prompt (后续逻辑不变...)
+        # 4. 构建 Prompt
         filename = Path(file_path).name
-        prompt = self._build_prompt(filename, fingerprint)
+        return {"filename": filename, "fingerprint": fingerprint, "prompt": self._build_prompt(filename, fingerprint)}
 
-        # 5. 调用 LLM 获取语义标签
+    def _cache_path(self, prepared: Dict[str, Any]) -> Path:
+        """
+        缓存键取 (模型, 系统提示词, Prompt) 的哈希：Prompt 由文件名与完整指纹 (行数、列类型、样本) 生成，
+        数据或 Prompt 模板任一变化都会落到新的缓存文件。
+        """
+        digest = hashlib.blake2b(digest_size=8)
+        for part in (self.llm.model_name, self._SYSTEM_PROMPT, prepared["prompt"]):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return self.cache_dir / f"{prepared['filename']}.{digest.hexdigest()}.json"
+
+    def _load_cached(self, prepared: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        path = self._cache_path(prepared)
         try:
-            print(f"   >>> Sending metadata of [{filename}] to model...")
-            ai_result = self.llm.query_json(
-                prompt=prompt,
-                system_prompt="You are a data analysis assistant that outputs only valid JSON."
-            )
-        except Exception as e:
-            logger.error(f"LLM inference failed: {e}")
+            with open(path, "rb") as f:
+                result = _json_loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable semantic cache {path}: {e}")
+            return None
+        logger.info(f"Semantic cache hit for {prepared['filename']}")
+        return result
+
+    def _store_cached(self, prepared: Dict[str, Any], ai_result: Dict[str, Any]) -> None:
+        """
+        先写临时文件再 os.replace，并发分析或中途退出都不会留下半截的缓存文件。
+        临时文件名由 mkstemp 生成，analyze_many 的多个线程同时写同一份缓存时互不干扰。
+        """
+        path = self._cache_path(prepared)
+        tmp = None
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(_json_dumps(ai_result))
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Failed to write semantic cache {path}: {e}")
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _merge(file_path: str, prepared: Dict[str, Any], ai_result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if ai_result is None:
             ai_result = {
                 "dataset_type": "UNKNOWN",
                 "description": "AI analysis failed.",
                 "semantic_tags": {}
             }
+        fingerprint = prepared["fingerprint"]
 
         # 6. 合并结果
         final_summary = {
             "file_info": {
                 "path": str(file_path),
-                "name": filename
+                "name": prepared["filename"]
             },
             "basic_stats": fingerprint,
             "semantic_analysis": ai_result
         }
 
+        # 7. 预先展开 (列名, 类型, 语义标签)，构建 Prompt 时直接遍历，无需逐列查两个字典
+        tags = ai_result.get("semantic_tags") if isinstance(ai_result, dict) else None
+        tag_get = tags.get if isinstance(tags, dict) else {}.get
+        final_summary["_prebuilt_columns"] = [
+            [col, str(info.get('dtype')), tag_get(col, "UNKNOWN")]
+            for col, info in fingerprint.get("column_stats", {}).items()
+        ]
+
         return final_summary
 
 
+async def analyze_many(analyzer: SemanticAnalyzer, file_paths: List[str],
+                       concurrency: int = 8, force: bool = False) -> List[Dict[str, Any]]:
+    """
+    并发分析多个文件 (结果顺序与 file_paths 一致)。
+    LLM 请求是纯 I/O 等待，N 个文件的总耗时接近单个文件；Semaphore 限制同时在途的请求数。
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run(path):
+        async with sem:
+            return await analyzer.analyze_async(path, force=force)
+
+    try:
+        return await asyncio.gather(*(run(p) for p in file_paths))
+    finally:
+        await analyzer.llm.aclose()
+        if analyzer.fallback_llm is not None:
+            await analyzer.fallback_llm.aclose()
+
+
 # --- 实战测试部分 ---
 if __name__ == "__main__":
     # 设置日志级别以便观察过程
@@ -196,13 +499,13 @@ if __name__ == "__main__":
     # 4. 遍历文件进行分析
     print(f"✅ Found {len(found_files)} files. Starting Batch Analysis...\n")
 
-    for file_path in found_files:
+    # 所有文件并发分析，再按顺序展示
+    results = asyncio.run(analyze_many(analyzer, [str(f) for f in found_files]))
+
+    for file_path, result in zip(found_files, results):
         print(f"--------------------------------------------------")
         print(f"📂 Processing: {file_path.name}")
 
-        # 执行分析
-        result = analyzer.analyze(str(file_path))
-
         # 检查是否出错
         if "error" in result:
             print(f"❌ Error: {result['error']}")
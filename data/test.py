@@ -54,26 +54,45 @@
 # # 4. 显示图表
 # fig.show()
 
-import pandas as pd
-import plotly.express as px
+import numpy as np
+import plotly.graph_objects as go
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
-# 1. 读取数据
-# 建议只读取 needed 列 ('trip_distance') 以节省内存和提高速度
-df = pd.read_parquet('yellow_tripdata_2025-01.parquet')
+FILE = 'yellow_tripdata_2025-01.parquet'
+COLUMN = 'total_amount'
+N_BINS = 100
 
-# # 2. 绘制直方图
-# # 这里完全保留原始数据，不截断也不过滤
-# fig = px.histogram(df, x='trip_distance', title='Histogram of Trip Distance')
-#
-# # 3. 显示图表
-# fig.show()
-# 按“天”聚合，观察每日收入波动
+# 1. 取值范围直接读 footer 里各 row group 的统计信息 (min/max)，不扫描数据
+#    这里完全保留原始数据的范围，不截断也不过滤
+meta = pq.read_metadata(FILE)
+col_idx = meta.schema.names.index(COLUMN)
+lows, highs = [], []
+for i in range(meta.num_row_groups):
+    st = meta.row_group(i).column(col_idx).statistics
+    if st is not None and st.has_min_max:
+        lows.append(st.min)
+        highs.append(st.max)
+# 文件没有写统计信息时退回固定范围
+edges = np.linspace(min(lows), max(highs), N_BINS + 1) if lows else np.linspace(-10, 200, N_BINS + 1)
 
+# 2. 按批流式读取单列并在本地分箱，内存中始终只有一批数据
+scanner = ds.dataset(FILE).scanner(columns=[COLUMN], batch_size=1_000_000)
+counts = np.zeros(N_BINS, dtype=np.int64)
+for batch in scanner.to_batches():
+    values = batch.column(COLUMN).to_numpy(zero_copy_only=False)
+    c, _ = np.histogram(values[~np.isnan(values)], bins=edges)
+    counts += c
+
+# 3. 只把 100 个柱子交给 Plotly，而不是几百万个原始值
+# # 按“天”聚合，观察每日收入波动
+#
 # df['tpep_pickup_datetime'] = pd.to_datetime(df['tpep_pickup_datetime'])
 # df_weekly = df.groupby(pd.Grouper(key='tpep_pickup_datetime', freq='W')).sum(numeric_only=True)
 #
 # fig = px.line(df_weekly, x=df_weekly.index, y='total_amount',
 #               title='Weekly Trend of Total Amount Over Time')
 
-fig = px.histogram(df, x='total_amount', title='Histogram of Total Amount')
-fig.show()
\ No newline at end of file
+fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges)))
+fig.update_layout(title='Histogram of Total Amount', xaxis_title=COLUMN, yaxis_title='count', bargap=0)
+fig.show()
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from core.llm import AI_client
+from core.llm.AI_client import AIClient
+
+
+@pytest.fixture
+def make_client(monkeypatch):
+    # 不发起连接预热请求
+    monkeypatch.setattr(AIClient, "_start_warmup", lambda self: None)
+    return lambda: AIClient(api_key="sk-test")
+
+
+def test_aclose_keeps_shared_pool_open_for_other_clients(make_client):
+    async def scenario():
+        a, b = make_client(), make_client()
+        a._async_client()
+        b_client = b._async_client()
+        http = AI_client._async_http_client()
+
+        await a.aclose()
+        assert not http.is_closed
+        assert b._async_client() is b_client
+
+        await b.aclose()
+        assert http.is_closed
+        assert AI_client._async_http_client() is not http
+
+    asyncio.run(scenario())
+
+
+def test_aclose_without_async_client_is_noop(make_client):
+    async def scenario():
+        a, b = make_client(), make_client()
+        b._async_client()
+        http = AI_client._async_http_client()
+        await a.aclose()
+        assert not http.is_closed
+        await b.aclose()
+
+    asyncio.run(scenario())
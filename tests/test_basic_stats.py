@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from core.profiler.basic_stats import get_column_stats, get_dataset_fingerprint
+
+
+def test_samples_skip_nulls_and_keep_numeric_types():
+    df = pd.DataFrame({"fare": [np.nan, 12.5, 7.0, np.nan, 3.25], "zone": [None, "A", None, "B", "C"]})
+    stats = get_column_stats(df)
+    assert stats["fare"]["samples"] == [12.5, 7.0, 3.25]
+    assert stats["zone"]["samples"] == ["A", "B", "C"]
+    assert stats["fare"]["missing_count"] == 2
+    assert (stats["fare"]["min"], stats["fare"]["max"]) == (3.25, 12.5)
+
+
+def test_samples_accept_list_and_array_cells():
+    df = pd.DataFrame({"stops": [[1, 2], None, np.array([3]), [4]]})
+    stats = get_column_stats(df)
+    assert len(stats["stops"]["samples"]) == 3
+
+
+def test_samples_fall_back_to_whole_column_when_head_is_empty():
+    df = pd.DataFrame({"tip": [np.nan] * 40 + [1.0, 2.0, 3.0]})
+    assert get_column_stats(df)["tip"]["samples"] == [1.0, 2.0, 3.0]
+
+
+def test_fingerprint_counts():
+    fp = get_dataset_fingerprint(pd.DataFrame({"a": [1, 2, 3]}))
+    assert (fp["rows"], fp["cols"], fp["is_geospatial"]) == (3, 1, False)
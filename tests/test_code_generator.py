@@ -0,0 +1,77 @@
+from core.generation.code_generator import CodeGenerator, _condense_trace
+
+_LIB = '/usr/lib/python3/site-packages/pandas/core/frame.py'
+
+
+def _frame(path, line, name, src="x = 1"):
+    return f'  File "{path}", line {line}, in {name}\n    {src}\n'
+
+
+def _trace(*frames, exc="KeyError: 'zone'"):
+    return "Traceback (most recent call last):\n" + "".join(frames) + exc
+
+
+def test_condense_trace_drops_library_frames():
+    trace = _trace(_frame("<llm>", 3, "plot"), _frame(_LIB, 4102, "__getitem__"), _frame("<llm>", 9, "helper"))
+    condensed = _condense_trace(trace)
+    assert "site-packages" not in condensed
+    assert '"<llm>", line 3' in condensed and '"<llm>", line 9' in condensed
+    assert "(1 library/older frames omitted)" in condensed
+    assert condensed.endswith("KeyError: 'zone'")
+
+
+def test_condense_trace_keeps_last_frames_only():
+    trace = _trace(*(_frame("<llm>", i, f"f{i}") for i in range(12)))
+    condensed = _condense_trace(trace, max_frames=3)
+    assert [f"line {i}," in condensed for i in (8, 9, 10, 11)] == [False, True, True, True]
+    assert "(9 library/older frames omitted)" in condensed
+
+
+def test_condense_trace_keeps_innermost_frame_when_all_are_library():
+    trace = _trace(_frame(_LIB, 1, "a"), _frame(_LIB, 2, "b"))
+    condensed = _condense_trace(trace)
+    assert "line 2, in b" in condensed and "line 1, in a" not in condensed
+
+
+def test_condense_trace_multiline_exception_and_plain_text():
+    trace = _trace(_frame("<llm>", 1, "plot"), exc="ValueError: bad\nmore detail")
+    assert _condense_trace(trace).endswith("ValueError: bad\nmore detail")
+    assert _condense_trace("SyntaxError: invalid syntax") == "SyntaxError: invalid syntax"
+
+
+class _CountingLLM:
+    """记录调用次数的假客户端"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def chat(self, messages, json_mode=False):
+        self.calls += 1
+        return f"reply {self.calls}"
+
+
+def _summary(dtype="float64"):
+    return {
+        "variable_name": "df_trips",
+        "file_info": {"name": "trips.csv"},
+        "basic_stats": {"column_stats": {"fare_amount": {"dtype": dtype}}},
+        "semantic_analysis": {"semantic_tags": {"fare_amount": "METRIC"}},
+    }
+
+
+def test_fix_code_reuses_reply_for_same_prompt():
+    llm = _CountingLLM()
+    generator = CodeGenerator(llm)
+    first = generator.fix_code("x = 1", "KeyError: 'zone'", [_summary()])
+    assert generator.fix_code("x = 1", "KeyError: 'zone'", [_summary()]) == first
+    assert llm.calls == 1
+
+
+def test_reply_cache_misses_when_dtypes_change():
+    llm = _CountingLLM()
+    generator = CodeGenerator(llm)
+    generator.generate_code("plot fares", [_summary()])
+    generator.fix_code("x = 1", "KeyError: 'zone'", [_summary()])
+    generator.generate_code("plot fares", [_summary(dtype="float32")])
+    generator.fix_code("x = 1", "KeyError: 'zone'", [_summary(dtype="float32")])
+    assert llm.calls == 4
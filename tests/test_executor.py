@@ -0,0 +1,41 @@
+import textwrap
+
+from core.execution.executor import _dedent, _extract_last_fence
+
+
+def test_extract_last_fence_takes_last_tagged_block():
+    text = "```python\nold = 1\n```\nsome text\n```Python\nnew = 2\n```\n"
+    assert _extract_last_fence(text, "```python") == "new = 2\n"
+
+
+def test_extract_last_fence_any_block():
+    text = "intro\n```\na = 1\n```\n```sql\nselect 1\n```"
+    assert _extract_last_fence(text, "```") == "select 1\n"
+
+
+def test_extract_last_fence_keeps_indentation_of_first_code_line():
+    text = "    ```python\n    def plot(data_context):\n        return 1\n    ```"
+    assert _extract_last_fence(text, "```python") == "    def plot(data_context):\n        return 1\n    "
+
+
+def test_extract_last_fence_unclosed_block():
+    assert _extract_last_fence("```python\nx = 1\n", "```python") is None
+    assert _extract_last_fence("no fences here", "```") is None
+    assert _extract_last_fence("```python```", "```python") is None
+
+
+def test_dedent_strips_uniform_indent():
+    block = "\n    import pandas as pd\n\n    def plot(dc):\n        return 1\n"
+    assert _dedent(block) == "import pandas as pd\n\ndef plot(dc):\n    return 1\n"
+
+
+def test_dedent_falls_back_when_a_line_is_shallower():
+    block = "        a = 1\n    b = 2\n"
+    assert _dedent(block) == textwrap.dedent(block)
+
+
+def test_dedent_mixed_tabs_and_spaces_and_blank_input():
+    block = " \ta = 1\n \tb = 2\n"
+    assert _dedent(block) == textwrap.dedent(block)
+    assert _dedent("\n   \n") == ""
+    assert _dedent("x = 1\n") == "x = 1\n"
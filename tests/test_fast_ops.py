@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from core.execution import fast_ops
+
+needs_numba = pytest.mark.skipif(not fast_ops.NUMBA_AVAILABLE, reason="numba 未安装，内核即 numpy 实现")
+
+
+def test_bin_2d_ignores_nan_and_out_of_range_points():
+    x = np.array([0.1, np.nan, 0.9, 1.5, 0.5])
+    y = np.array([0.1, 0.5, np.nan, 0.5, 0.5])
+    counts = fast_ops.bin_2d(x, y, 0.0, 1.0, 0.0, 1.0, 2, 2)
+    assert counts.dtype == np.int64
+    assert counts.sum() == 2
+    assert counts[0, 0] == 1 and counts[1, 1] == 1
+
+
+def test_bin_2d_includes_upper_edge():
+    counts = fast_ops.bin_2d([1.0], [1.0], 0.0, 1.0, 0.0, 1.0, 4, 4)
+    assert counts[3, 3] == 1
+
+
+@pytest.mark.parametrize("bounds", [(1.0, 1.0, 0.0, 1.0), (0.0, 1.0, 2.0, 1.0), (np.nan, 1.0, 0.0, 1.0)])
+def test_bin_2d_rejects_empty_ranges(bounds):
+    with pytest.raises(ValueError):
+        fast_ops.bin_2d([0.5], [0.5], *bounds, 2, 2)
+
+
+def test_bin_2d_rejects_zero_bins():
+    with pytest.raises(ValueError):
+        fast_ops.bin_2d([0.5], [0.5], 0.0, 1.0, 0.0, 1.0, 0, 2)
+
+
+def test_groupby_count_rejects_keys_outside_range():
+    with pytest.raises(ValueError):
+        fast_ops.groupby_count_i64([0, 3], n=3)
+    with pytest.raises(ValueError):
+        fast_ops.groupby_count_i64([-1, 2])
+
+
+def test_groupby_count_empty_keys():
+    assert fast_ops.groupby_count_i64([], n=4).tolist() == [0, 0, 0, 0]
+
+
+@needs_numba
+def test_bin_2d_kernel_matches_numpy():
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-1.0, 2.0, 10_000)
+    y = rng.uniform(-1.0, 2.0, 10_000)
+    x[::97] = np.nan
+    args = (0.0, 1.0, 0.0, 1.0, 16, 8)
+    expected = fast_ops._bin_2d_numpy(x[~np.isnan(x)], y[~np.isnan(x)], *args)
+    np.testing.assert_array_equal(fast_ops._bin_2d_kernel(x, y, *args), expected)
+
+
+@needs_numba
+def test_haversine_kernel_matches_numpy():
+    rng = np.random.default_rng(1)
+    lat1, lat2 = rng.uniform(40.5, 41.0, (2, 1000))
+    lon1, lon2 = rng.uniform(-74.3, -73.7, (2, 1000))
+    np.testing.assert_allclose(fast_ops.haversine_pairs(lat1, lon1, lat2, lon2),
+                               fast_ops._haversine_numpy(lat1, lon1, lat2, lon2), rtol=1e-9)
+
+
+@needs_numba
+def test_groupby_count_kernel_matches_numpy():
+    keys = np.random.default_rng(2).integers(0, 265, 5000)
+    np.testing.assert_array_equal(fast_ops.groupby_count_i64(keys, 265), fast_ops._groupby_count_numpy(keys, 265))
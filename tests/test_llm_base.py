@@ -0,0 +1,42 @@
+import pytest
+
+from core.llm.base import BaseLLMClient
+
+
+class _EchoClient(BaseLLMClient):
+    """回复固定文本的最小客户端"""
+    model_name = "echo"
+
+    def __init__(self, reply: str):
+        self.reply = reply
+
+    def _probe(self) -> bool:
+        return True
+
+    def chat(self, messages, json_mode=False) -> str:
+        return self.reply
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ('{"a": 1}', '{"a": 1}'),
+    ('  {"a": 1}\n', '{"a": 1}'),
+    ('```json\n{"a": 1}\n```', '{"a": 1}'),
+    ('```JSON\n{"a": 1}\n```\n', '{"a": 1}'),
+    ('```\n{"a": 1}\n```', '{"a": 1}'),
+    ('```json\n{"a": 1}', '{"a": 1}'),  # 回复被截断，缺少结尾围栏
+    ('```json\n{"code": "```x```"}\n```', '{"code": "```x```"}'),
+])
+def test_clean_markdown(raw, expected):
+    assert BaseLLMClient._clean_markdown(raw) == expected
+
+
+def test_query_json_strips_fence_and_rejects_invalid():
+    assert _EchoClient('```json\n{"tags": {"a": "LAT"}}\n```').query_json("p") == {"tags": {"a": "LAT"}}
+    with pytest.raises(ValueError):
+        _EchoClient("not json").query_json("p")
+
+
+def test_json_messages_mentions_json():
+    messages = BaseLLMClient.json_messages("describe the file", "You are helpful.")
+    assert "json" in messages[0]["content"].lower()
+    assert messages[1] == {"role": "user", "content": "describe the file"}
@@ -0,0 +1,39 @@
+import pytest
+
+from core.ingestion.loader_factory import CsvLoader
+
+
+@pytest.mark.parametrize("content, rows", [
+    (b"a,b\n1,2\n3,4\n", 2),
+    (b"a,b\n1,2\n3,4", 2),  # 最后一行没有换行符
+    (b"a,b\n", 0),  # 只有表头
+    (b"a,b", 0),
+    (b"", 0),
+    (b"a,b\r\n1,2\r\n", 1),
+])
+def test_csv_count_rows(tmp_path, content, rows):
+    path = tmp_path / "data.csv"
+    path.write_bytes(content)
+    assert CsvLoader().count_rows(str(path)) == rows
+
+
+def test_csv_count_rows_across_read_chunks(tmp_path):
+    path = tmp_path / "big.csv"
+    # 超过 1MB 的读取块，且块边界落在行中间
+    path.write_bytes(b"id\n" + b"".join(b"%07d\n" % i for i in range(200_000)))
+    assert CsvLoader().count_rows(str(path)) == 200_000
+
+
+def test_csv_peek_matches_load_dtypes_and_nulls(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "trips.csv"
+    path.write_text(
+        "VendorID,tpep_pickup_datetime,pickup_date,store_and_fwd_flag,fare_amount\n"
+        "1,2025-01-01 00:10:00,2025-01-01,N,12.5\n"
+        "2,2025-01-01 00:20:00,2025-01-01,,7.0\n"
+    )
+    loader = CsvLoader()
+    peek, full = loader.peek(str(path), n=10), loader.load(str(path))
+    assert peek.dtypes.astype(str).to_dict() == full.dtypes.astype(str).to_dict()
+    assert peek["store_and_fwd_flag"].isna().tolist() == [False, True]
+    assert peek["tpep_pickup_datetime"].tolist() == full["tpep_pickup_datetime"].tolist()
@@ -0,0 +1,33 @@
+from core.generation.scaffold import STChartScaffold
+
+
+def _summary(dtype="float64", tag="METRIC", n_extra=0):
+    column_stats = {"fare_amount": {"dtype": dtype}, **{f"c{i}": {"dtype": "int64"} for i in range(n_extra)}}
+    return {
+        "variable_name": "df_trips",
+        "file_info": {"name": "trips.csv"},
+        "basic_stats": {"column_stats": column_stats},
+        "semantic_analysis": {"semantic_tags": {"fare_amount": tag}},
+    }
+
+
+def test_system_prompt_is_reused_for_the_same_summaries():
+    scaffold = STChartScaffold()
+    first = scaffold.get_system_prompt([_summary()])
+    assert scaffold.get_system_prompt([_summary()]) is first
+    assert "fare_amount (float64, METRIC)" in first
+
+
+def test_system_prompt_changes_with_dtype_or_tag():
+    scaffold = STChartScaffold()
+    base = scaffold.get_system_prompt([_summary()])
+    assert scaffold.get_system_prompt([_summary(dtype="float32")]) != base
+    assert scaffold.get_system_prompt([_summary(tag="UNKNOWN")]) != base
+
+
+
+def test_wide_tables_are_truncated_with_tagged_columns_first():
+    scaffold = STChartScaffold()
+    prompt = scaffold.get_system_prompt([_summary(n_extra=STChartScaffold.MAX_PROMPT_COLUMNS + 5)])
+    assert "fare_amount (float64, METRIC)" in prompt
+    assert "... and 6 more columns" in prompt
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from core.profiler.semantic_analyzer import _TagStreamParser
+
+_REPLY = json.dumps({
+    "file_type": "trips",
+    "semantic_tags": {"pickup_lat": "LAT", "zone \"name\"": "CATEGORY", "fare": "METRIC"},
+    "summary": "ok",
+})
+_TAGS = [("pickup_lat", "LAT"), ('zone "name"', "CATEGORY"), ("fare", "METRIC")]
+
+
+def _feed_all(parser, chunks):
+    return [pair for chunk in chunks for pair in parser.feed(chunk)]
+
+
+@pytest.mark.parametrize("split", range(1, len(_REPLY)))
+def test_tag_parser_handles_any_chunk_boundary(split):
+    parser = _TagStreamParser()
+    assert _feed_all(parser, [_REPLY[:split], _REPLY[split:]]) == _TAGS
+
+
+def test_tag_parser_one_character_at_a_time():
+    parser = _TagStreamParser()
+    assert _feed_all(parser, list(_REPLY)) == _TAGS
+    assert parser.seen == {col for col, _ in _TAGS}
+
+
+def test_tag_parser_stops_at_non_string_value():
+    reply = '{"semantic_tags": {"a": "LAT", "b": null, "c": "LON"}}'
+    parser = _TagStreamParser()
+    assert _feed_all(parser, list(reply)) == [("a", "LAT")]
+
+
+def test_tag_parser_ignores_text_before_tags_object():
+    parser = _TagStreamParser()
+    reply = '{"columns": {"a": "b"}, "semantic_tags": {}, "extra": {"c": "d"}}'
+    assert _feed_all(parser, [reply[:20], reply[20:]]) == []
@@ -0,0 +1,44 @@
+import pytest
+
+from core.llm.semantic_cache import SemanticCache, _normalize
+
+
+def test_normalize_only_folds_case_and_whitespace():
+    assert _normalize("  Show   Trips\twith FARE > 50 ") == "show trips with fare > 50"
+
+
+@pytest.mark.parametrize("a, b", [
+    ("show trips with fare > 50", "show trips with fare < 50"),
+    ("show trips with fare > 50", "show trips with fare >= -50"),
+    ("distance 2.5", "distance 2-5"),
+    ("fare != 0", "fare = 0"),
+    ("pickup heatmap", "dropoff heatmap"),
+])
+def test_different_filters_do_not_share_a_key(a, b):
+    assert _normalize(a) != _normalize(b)
+    cache = SemanticCache()
+    cache.set("ns", a, "code-a")
+    assert cache.get("ns", b) is None
+    assert cache.get("ns", a.upper()) == "code-a"
+
+
+def test_namespaces_are_isolated():
+    cache = SemanticCache()
+    cache.set("ns1", "plot fares", "code")
+    assert cache.get("ns2", "plot fares") is None
+
+
+def test_blank_query_is_never_cached():
+    cache = SemanticCache()
+    cache.set("ns", "   ", "code")
+    assert cache.get("ns", "") is None
+
+
+def test_lru_eviction():
+    cache = SemanticCache(max_entries=2)
+    cache.set("ns", "a", 1)
+    cache.set("ns", "b", 2)
+    assert cache.get("ns", "a") == 1  # a 变为最近使用
+    cache.set("ns", "c", 3)
+    assert cache.get("ns", "b") is None
+    assert cache.get("ns", "a") == 1 and cache.get("ns", "c") == 3